@@ -0,0 +1,186 @@
+"""Async Supabase (PostgREST) data access for the provider backend.
+
+All table access goes through a single pooled ``httpx.AsyncClient`` so that
+handlers never block the event loop on a PostgREST round trip.
+"""
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from postgrest import AsyncPostgrestClient
+from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS
+from postgrest.exceptions import APIError
+from pydantic_core import to_jsonable_python
+
+
+class DatabaseTimeout(Exception):
+    """Raised when a PostgREST call exceeds its per-call timeout."""
+
+
+class ProviderConflict(Exception):
+    """A unique constraint rejected a registration; ``field`` is the duplicated column."""
+
+    def __init__(self, field: str):
+        super().__init__(f"duplicate {field}")
+        self.field = field
+
+
+# Unique constraints on providers (see the register_provider migration)
+UNIQUE_CONSTRAINTS = {
+    "providers_mobile_number_key": "mobile_number",
+    "providers_provider_id_key": "provider_id",
+}
+
+
+class _PooledPostgrestClient(AsyncPostgrestClient):
+    """AsyncPostgrestClient whose session uses our connection limits."""
+
+    def __init__(self, base_url: str, *, headers: Dict[str, str], timeout: float,
+                 limits: httpx.Limits, transport: Optional[httpx.AsyncBaseTransport] = None):
+        # create_session() runs inside the base initialiser, so set these first
+        self._limits = limits
+        self._transport = transport
+        super().__init__(base_url, headers=headers, timeout=timeout)
+
+    def create_session(self, base_url, headers, timeout, verify=True):
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            verify=verify,
+            follow_redirects=True,
+            http2=self._transport is None,
+            limits=self._limits,
+            transport=self._transport,
+        )
+
+
+class SupabaseDB:
+    """Shared keep-alive PostgREST client with per-call timeouts."""
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        *,
+        timeout: Optional[float] = None,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: float = 30.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.url = url.rstrip("/")
+        self.key = key
+        self.timeout = timeout or float(os.environ.get("SUPABASE_TIMEOUT_SECONDS", "10"))
+        max_connections = max_connections or int(os.environ.get("SUPABASE_MAX_CONNECTIONS", "100"))
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections or max_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        headers = {
+            **DEFAULT_POSTGREST_CLIENT_HEADERS,
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+        }
+        self.postgrest = _PooledPostgrestClient(
+            f"{self.url}/rest/v1",
+            headers=headers,
+            timeout=self.timeout,
+            limits=limits,
+            transport=transport,
+        )
+
+    def table(self, name: str):
+        return self.postgrest.from_(name)
+
+    def rpc(self, fn: str, params: Dict[str, Any]):
+        return self.postgrest.rpc(fn, params)
+
+    async def execute(self, query, timeout: Optional[float] = None):
+        """Run a built query, failing with DatabaseTimeout after ``timeout`` seconds."""
+        try:
+            return await asyncio.wait_for(query.execute(), timeout or self.timeout)
+        except (asyncio.TimeoutError, httpx.TimeoutException) as ex:
+            raise DatabaseTimeout(str(ex) or "Supabase request timed out") from ex
+
+    async def aclose(self):
+        await self.postgrest.aclose()
+
+
+def _rows(res) -> List[Dict[str, Any]]:
+    return getattr(res, 'data', None) or []
+
+
+def _first(res) -> Optional[Dict[str, Any]]:
+    rows = _rows(res)
+    return rows[0] if rows else None
+
+
+class ProviderRepository:
+    """Queries against the ``providers`` and ``profiles`` tables."""
+
+    def __init__(self, db: SupabaseDB):
+        self.db = db
+
+    async def get(self, provider_id: str, columns: str = "*") -> Optional[Dict[str, Any]]:
+        res = await self.db.execute(
+            self.db.table("providers").select(columns).eq("provider_id", provider_id).limit(1)
+        )
+        return _first(res)
+
+    async def existing_mobiles(self, mobile_numbers: List[str]) -> List[str]:
+        if not mobile_numbers:
+            return []
+        res = await self.db.execute(
+            self.db.table("providers").select("mobile_number").in_("mobile_number", mobile_numbers)
+        )
+        return [row["mobile_number"] for row in _rows(res)]
+
+    async def upsert_profiles(self, profiles: List[Dict[str, Any]]):
+        if profiles:
+            await self.db.execute(self.db.table("profiles").upsert(to_jsonable_python(profiles)))
+
+    async def register(self, row: Dict[str, Any], profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Insert the profile and provider in one transaction (``register_provider`` RPC).
+
+        Returns the inserted provider row; raises ProviderConflict on a duplicate
+        mobile number or provider ID.
+        """
+        try:
+            res = await self.db.execute(self.db.rpc("register_provider", {
+                "p_provider": to_jsonable_python(row),
+                "p_profile": to_jsonable_python(profile),
+            }))
+        except APIError as ex:
+            if ex.code == "23505":
+                text = f"{ex.message} {ex.details}"
+                for constraint, field in UNIQUE_CONSTRAINTS.items():
+                    if constraint in text:
+                        raise ProviderConflict(field) from ex
+            raise
+        return res.data
+
+    async def insert_many(self, rows: List[Dict[str, Any]]):
+        """Insert a batch in one request (all-or-nothing in PostgREST)."""
+        if rows:
+            await self.db.execute(
+                self.db.table("providers").insert(to_jsonable_python(rows), returning="minimal")
+            )
+
+    async def update_where(self, column: str, value: Any, changes: Dict[str, Any]) -> List[Dict[str, Any]]:
+        res = await self.db.execute(
+            self.db.table("providers").update(to_jsonable_python(changes)).eq(column, value)
+        )
+        return _rows(res)
+
+    async def page(self, columns: str = "*", after: Optional[Tuple[str, str]] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """One keyset page ordered by (created_at, id), starting after ``after``."""
+        query = self.db.table("providers").select(columns).order("created_at").order("id").limit(limit)
+        if after:
+            created_at, row_id = after
+            query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{row_id})')
+        res = await self.db.execute(query)
+        return _rows(res)
+
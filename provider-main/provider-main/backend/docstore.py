@@ -0,0 +1,177 @@
+"""Content-addressed document store for provider uploads.
+
+Blobs are keyed by the SHA-256 of their content and laid out with a
+two-level fan-out (``blobs/ab/cd/abcd...``) so no directory grows without
+bound. A small SQLite index tracks reference counts per blob and maps each
+provider document (provider_id, kind, position) to its blob, so identical
+uploads are stored once and removed when the last reference goes away.
+
+Several worker processes may share one store. Every reference-count change
+runs in a ``BEGIN IMMEDIATE`` transaction together with the matching file
+move or unlink, so SQLite's write lock keeps one worker from deleting a
+blob that another has just re-referenced.
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+CONTENT_ID_PREFIX = "sha256:"
+
+
+def content_id(sha256: str) -> str:
+    return f"{CONTENT_ID_PREFIX}{sha256}"
+
+
+def blob_key(cid: str) -> str:
+    if not cid.startswith(CONTENT_ID_PREFIX):
+        raise ValueError(f"Not a content ID: {cid}")
+    return cid[len(CONTENT_ID_PREFIX):]
+
+
+class DocumentStore:
+    """Reference-counted blob store with a provider document index."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.blob_dir = self.root / "blobs"
+        self.tmp_dir = self.root / "tmp"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Writers in other processes hold the lock only briefly; wait for them
+        self._conn = sqlite3.connect(self.root / "index.sqlite3", timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                refs INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS documents (
+                provider_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                position INTEGER NOT NULL DEFAULT 0,
+                sha256 TEXT NOT NULL REFERENCES blobs(sha256),
+                filename TEXT,
+                PRIMARY KEY (provider_id, kind, position)
+            );
+        """)
+
+    @contextmanager
+    def _write(self):
+        """Thread lock plus an immediate (write-locked) transaction across processes."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def temp_path(self) -> Path:
+        return self.tmp_dir / uuid.uuid4().hex
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.blob_dir / sha256[:2] / sha256[2:4] / sha256
+
+    def path_for(self, cid: str) -> Optional[Path]:
+        path = self.blob_path(blob_key(cid))
+        return path if path.exists() else None
+
+    def commit(self, tmp: Path, sha256: str, size: int) -> str:
+        """Move a fully written temp file into the store and take one reference.
+
+        If the blob already exists the temp file is discarded, so a duplicate
+        upload costs nothing beyond hashing it.
+        """
+        dest = self.blob_path(sha256)
+        with self._write():
+            if dest.exists():
+                tmp.unlink(missing_ok=True)
+            else:
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp, dest)
+            self._conn.execute(
+                "INSERT INTO blobs (sha256, size, refs, created_at) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT(sha256) DO UPDATE SET refs = refs + 1",
+                (sha256, size, datetime.now(timezone.utc).isoformat()),
+            )
+        return content_id(sha256)
+
+    def store_bytes(self, data: bytes) -> str:
+        """Store an in-memory object (e.g. a rendered ID card) and take one reference."""
+        tmp = self.temp_path()
+        tmp.write_bytes(data)
+        return self.commit(tmp, hashlib.sha256(data).hexdigest(), len(data))
+
+    def unref(self, sha256s: List[str]):
+        """Drop one reference per entry, deleting blobs that reach zero."""
+        with self._write():
+            self._unref_locked(sha256s)
+
+    def _unref_locked(self, sha256s: List[str]):
+        # Runs inside a write transaction: the refs read here are current
+        # for every process, and files are unlinked before it commits
+        for sha in sha256s:
+            self._conn.execute("UPDATE blobs SET refs = refs - 1 WHERE sha256 = ?", (sha,))
+        dead = [row[0] for row in self._conn.execute(
+            f"SELECT sha256 FROM blobs WHERE refs <= 0 AND sha256 IN ({','.join('?' * len(sha256s))})",
+            sha256s,
+        )] if sha256s else []
+        for sha in dead:
+            self._conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha,))
+            self.blob_path(sha).unlink(missing_ok=True)
+
+    def attach(self, provider_id: str, entries: List[Tuple[str, int, str, Optional[str]]]):
+        """Record (kind, position, sha256, filename) rows for a provider.
+
+        The references taken by :meth:`commit` are handed over to these rows.
+        Call this only once the provider row exists; a document already
+        recorded in the same (kind, position) slot is replaced and its
+        reference dropped, other documents of the provider are left alone.
+        """
+        self.attach_many({provider_id: entries})
+
+    def attach_many(self, batch: Dict[str, List[Tuple[str, int, str, Optional[str]]]]):
+        """Like :meth:`attach` for several providers in one transaction."""
+        with self._write():
+            replaced = []
+            for provider_id, entries in batch.items():
+                for kind, position, sha, filename in entries:
+                    old = self._conn.execute(
+                        "SELECT sha256 FROM documents WHERE provider_id = ? AND kind = ? AND position = ?",
+                        (provider_id, kind, position),
+                    ).fetchone()
+                    if old:
+                        replaced.append(old[0])
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO documents (provider_id, kind, position, sha256, filename) VALUES (?, ?, ?, ?, ?)",
+                        (provider_id, kind, position, sha, filename),
+                    )
+            self._unref_locked(replaced)
+
+    def documents(self, provider_id: str) -> List[Tuple[str, int, str, Optional[str]]]:
+        with self._lock:
+            return list(self._conn.execute(
+                "SELECT kind, position, sha256, filename FROM documents WHERE provider_id = ? ORDER BY kind, position",
+                (provider_id,),
+            ))
+
+    async def aattach(self, provider_id: str, entries):
+        await asyncio.to_thread(self.attach, provider_id, entries)
+
+    async def aunref(self, sha256s: List[str]):
+        await asyncio.to_thread(self.unref, sha256s)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,145 @@
+"""Write-behind batching for email-verified updates.
+
+``set_email_verified`` and the Supabase auth webhook submit events here
+instead of updating ``providers`` one row at a time. Events that arrive
+within one flush window are de-duplicated per email (or provider ID) and
+applied by a single ``mark_emails_verified`` RPC. Providers that are already
+verified are not written again, and a webhook event that was applied
+recently is answered from memory, so Supabase retries cost no writes.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from otp_delivery import ChannelMetrics
+
+Rows = List[Dict[str, Any]]
+
+
+class EmailVerificationQueue:
+    """Collects verification events and flushes them every ``interval`` seconds."""
+
+    def __init__(self, db, *, interval: float = 0.025, max_batch: int = 500,
+                 recent_ttl: float = 300.0, max_recent: int = 10_000):
+        self.db = db
+        self.interval = interval
+        self.max_batch = max_batch
+        self.recent_ttl = recent_ttl
+        self.max_recent = max_recent
+        # key -> (verified_at, future); the first event for a key wins
+        self._pending: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self._recent: "OrderedDict[Tuple[str, str], Tuple[float, Rows]]" = OrderedDict()
+        self._flusher: Optional[asyncio.Task] = None
+        self._flushes: set = set()
+        self.metrics = ChannelMetrics()
+        self.events = self.coalesced = self.replayed = self.written = 0
+        self.last_batch = 0
+
+    @staticmethod
+    def key(column: str, value: str) -> str:
+        return f"{column}:{value}"
+
+    async def submit(self, column: str, value: str, verified_at: str) -> Rows:
+        """Mark providers matching ``column = value`` verified; returns the matched rows."""
+        self.events += 1
+        key = self.key(column, value)
+        replay = self._replay(key, verified_at)
+        if replay is not None:
+            self.replayed += 1
+            return replay
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending[1])
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = (verified_at, future)
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+        rows = await asyncio.shield(future)
+        if rows:
+            self._remember(key, verified_at, rows)
+        return rows
+
+    def _replay(self, key: str, verified_at: str) -> Optional[Rows]:
+        entry = self._recent.get((key, verified_at))
+        if entry is None:
+            return None
+        if time.monotonic() >= entry[0]:
+            del self._recent[(key, verified_at)]
+            return None
+        return entry[1]
+
+    def _remember(self, key: str, verified_at: str, rows: Rows):
+        self._recent[(key, verified_at)] = (time.monotonic() + self.recent_ttl, rows)
+        self._recent.move_to_end((key, verified_at))
+        while len(self._recent) > self.max_recent:
+            self._recent.popitem(last=False)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    def _start_flush(self):
+        task = asyncio.create_task(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def flush(self):
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        entries = []
+        for key, (verified_at, _) in batch.items():
+            column, value = key.split(":", 1)
+            entries.append({"key": key, column: value, "verified_at": verified_at})
+        started = time.perf_counter()
+        try:
+            res = await self.db.execute(self.db.rpc("mark_emails_verified", {"p_entries": entries}))
+        except Exception as ex:
+            self.metrics.observe(False, (time.perf_counter() - started) * 1000)
+            for _, future in batch.values():
+                if not future.done():
+                    future.set_exception(ex)
+                    future.exception()
+            return
+        self.metrics.observe(True, (time.perf_counter() - started) * 1000)
+        self.last_batch = len(entries)
+        matched: Dict[str, Rows] = {key: [] for key in batch}
+        for row in res.data or []:
+            matched.setdefault(row["key"], []).append({"id": row["id"], "provider_id": row["provider_id"]})
+            self.written += bool(row.get("changed"))
+        for key, (_, future) in batch.items():
+            if not future.done():
+                future.set_result(matched[key])
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": len(self._pending),
+            "events": self.events,
+            "coalesced": self.coalesced,
+            "replayed": self.replayed,
+            "rows_written": self.written,
+            "last_batch": self.last_batch,
+            "flushes": self.metrics.snapshot(),
+        }
+
+    async def aclose(self):
+        """Flush everything still queued (called on shutdown)."""
+        if self._flusher is not None:
+            await self._flusher
+        if self._flushes:
+            await asyncio.gather(*self._flushes)
+        await self.flush()
+
+
+def email_verification_from_env(db) -> EmailVerificationQueue:
+    """Queue configured by EMAIL_VERIFY_BATCH_MS and EMAIL_VERIFY_MAX_BATCH."""
+    return EmailVerificationQueue(
+        db,
+        interval=float(os.environ.get("EMAIL_VERIFY_BATCH_MS", "25")) / 1000,
+        max_batch=int(os.environ.get("EMAIL_VERIFY_MAX_BATCH", "500")),
+    )
@@ -0,0 +1,129 @@
+"""Conditional GET and byte-range helpers for binary and precomputed responses."""
+import asyncio
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match covers ``etag``."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single ``bytes=`` range into inclusive (start, end).
+
+    Returns None when there is no usable range (serve the full body) and
+    raises ValueError when the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None  # multi-range or unknown unit: ignore and send everything
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        start, end = max(size - length, 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def _read_slice(path: Path, start: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+
+async def binary_response(
+    request: Request,
+    etag: str,
+    media_type: str,
+    *,
+    path: Optional[Path] = None,
+    data: Optional[bytes] = None,
+    cache_control: str = "private, max-age=3600",
+    filename: Optional[str] = None,
+) -> Response:
+    """Serve ``path`` or ``data`` with a strong ETag, 304s and single byte ranges."""
+    headers: Dict[str, str] = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    if filename:
+        headers["Content-Disposition"] = f'inline; filename="{filename}"'
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    size = os.path.getsize(path) if path is not None else len(data)
+    if_range = request.headers.get("if-range")
+    try:
+        byte_range = parse_range(request.headers.get("range"), size) if not if_range or if_range == etag else None
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range is not None:
+        start, end = byte_range
+        length = end - start + 1
+        chunk = await asyncio.to_thread(_read_slice, path, start, length) if path is not None else data[start:end + 1]
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return Response(content=chunk, status_code=206, media_type=media_type, headers=headers)
+
+    if path is not None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    return Response(content=data, media_type=media_type, headers=headers)
+
+
+class PrecomputedJSON:
+    """A JSON body encoded once per data version and served with a strong ETag.
+
+    ``build`` is called again only when :meth:`response` is given a different
+    ``version`` object, so steady-state requests skip model validation and
+    JSON encoding entirely.
+    """
+
+    _UNSET = object()
+
+    def __init__(self, build: Callable[[], Any], cache_control: str = "public, max-age=60"):
+        self.build = build
+        self.cache_control = cache_control
+        self._version: Any = self._UNSET
+        self.body = b""
+        self.etag = ""
+
+    def refresh(self, version: Any = None):
+        if version is self._version:
+            return
+        self.body = json.dumps(self.build(), ensure_ascii=False, separators=(",", ":")).encode()
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+        self._version = version
+
+    def response(self, request: Request, version: Any = None) -> Response:
+        self.refresh(version)
+        headers = {"ETag": self.etag, "Cache-Control": self.cache_control}
+        if etag_matches(request, self.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
@@ -0,0 +1,144 @@
+"""Streaming ingestion of multipart registration documents.
+
+Each upload is copied to storage in fixed-size chunks on a worker thread,
+hashing as it goes, so large files never sit fully in memory and never
+block the event loop. All documents of a registration are saved at once
+and committed into the content-addressed :class:`DocumentStore`.
+"""
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
+
+from fastapi import UploadFile
+from pydantic import BaseModel
+
+from docstore import DocumentStore
+
+CHUNK_SIZE = 1024 * 1024
+# Matches the provider-docs bucket file_size_limit (50 MB)
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, filename: str, limit: int):
+        super().__init__(f"{filename} exceeds the {limit // (1024 * 1024)} MB upload limit")
+        self.filename = filename
+        self.limit = limit
+
+
+class StoredFile(BaseModel):
+    path: str
+    size: int
+    sha256: str
+    content_id: Optional[str] = None
+    filename: Optional[str] = None
+
+
+def _copy_stream(src: BinaryIO, dest: Path, filename: str, max_bytes: int) -> StoredFile:
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(dest, "wb") as out:
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(filename, max_bytes)
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        dest.unlink(missing_ok=True)
+        raise
+    return StoredFile(path=str(dest), size=size, sha256=digest.hexdigest())
+
+
+async def save_upload(file: UploadFile, store: DocumentStore, max_bytes: int = MAX_UPLOAD_BYTES) -> StoredFile:
+    """Stream one upload into ``store`` off the event loop.
+
+    The returned file holds one reference on its blob.
+    """
+    filename = os.path.basename(file.filename or "upload")
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLarge(filename, max_bytes)
+    tmp = store.temp_path()
+    written = await asyncio.to_thread(_copy_stream, file.file, tmp, filename, max_bytes)
+    cid = await asyncio.to_thread(store.commit, tmp, written.sha256, written.size)
+    return StoredFile(
+        path=str(store.blob_path(written.sha256)),
+        size=written.size,
+        sha256=written.sha256,
+        content_id=cid,
+        filename=filename,
+    )
+
+
+async def ingest_documents(
+    files: Dict[str, Union[UploadFile, List[UploadFile], None]],
+    store: DocumentStore,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+) -> Dict[str, Any]:
+    """Save every document concurrently.
+
+    Returns a dict shaped like ``files`` with a :class:`StoredFile` (or a list
+    of them) per key; missing optional documents are skipped. If any upload
+    fails, references already taken for this registration are dropped.
+    """
+    keys: List[tuple] = []
+    uploads: List[UploadFile] = []
+    for key, value in files.items():
+        if not value:
+            continue
+        if isinstance(value, list):
+            for index, item in enumerate(value):
+                keys.append((key, index))
+                uploads.append(item)
+        else:
+            keys.append((key, None))
+            uploads.append(value)
+
+    results = await asyncio.gather(
+        *(save_upload(upload, store, max_bytes) for upload in uploads),
+        return_exceptions=True,
+    )
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        committed = [r.sha256 for r in results if isinstance(r, StoredFile)]
+        await asyncio.to_thread(store.unref, committed)
+        raise errors[0]
+
+    stored: Dict[str, Any] = {}
+    for (key, index), result in zip(keys, results):
+        if index is None:
+            stored[key] = result
+        else:
+            stored.setdefault(key, []).append(result)
+    return stored
+
+
+def document_ids(stored: Dict[str, Any]) -> Dict[str, Any]:
+    """Map ingested documents to the content IDs kept in ``Provider.documents``."""
+    return {
+        key: [s.content_id for s in value] if isinstance(value, list) else value.content_id
+        for key, value in stored.items()
+    }
+
+
+def index_entries(stored: Dict[str, Any]) -> List[Tuple[str, int, str, Optional[str]]]:
+    """Rows for :meth:`DocumentStore.attach`."""
+    entries = []
+    for key, value in stored.items():
+        for position, s in enumerate(value if isinstance(value, list) else [value]):
+            entries.append((key, position, s.sha256, s.filename))
+    return entries
+
+
+def total_size(stored: Dict[str, Any]) -> int:
+    return sum(
+        sum(s.size for s in value) if isinstance(value, list) else value.size
+        for value in stored.values()
+    )
+
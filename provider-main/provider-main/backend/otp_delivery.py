@@ -0,0 +1,259 @@
+"""Background OTP delivery.
+
+``/api/otp/send`` only stores the code and enqueues a job. A small pool of
+worker tasks delivers it, first through the n8n webhook and then through
+AWS SNS, using one long-lived HTTP client and one cached SNS client. Each
+channel is retried with exponential backoff and sits behind a circuit
+breaker, so a dead webhook fails over to SNS without waiting on timeouts.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import boto3
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OtpDeliveryJob:
+    mobile_number: str
+    e164: str
+    code: str
+
+
+class DeliveryQueueFull(Exception):
+    """Raised when the delivery queue is at capacity."""
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive failures and half-opens after ``reset_after`` s.
+
+    While half-open only one caller is let through as a probe; the rest are
+    refused until the probe records its outcome (or is lost, e.g. cancelled,
+    for another ``reset_after`` seconds).
+    """
+
+    def __init__(self, threshold: int = 5, reset_after: float = 30.0):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_started: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state != "half-open":
+            return state == "closed"
+        now = time.monotonic()
+        if self.probe_started is not None and now - self.probe_started < self.reset_after:
+            return False
+        self.probe_started = now
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_started = None
+        if self.failures >= self.threshold or self.opened_at is not None:
+            # A failed half-open probe re-opens for another full period
+            self.opened_at = time.monotonic()
+
+
+class ChannelMetrics:
+    """Send counts and latency (ms) for one delivery channel."""
+
+    def __init__(self, window: int = 1024):
+        self.sent = 0
+        self.failed = 0
+        self.latencies: Deque[float] = deque(maxlen=window)
+
+    def observe(self, ok: bool, latency_ms: float):
+        if ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+        self.latencies.append(latency_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+
+        def pct(p: float) -> Optional[float]:
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 2) if ordered else None
+
+        return {"sent": self.sent, "failed": self.failed, "p50_ms": pct(0.50), "p95_ms": pct(0.95), "p99_ms": pct(0.99)}
+
+
+class OtpDeliveryService:
+    """Queue + worker pool delivering OTP codes via n8n, then SNS, then the log."""
+
+    def __init__(
+        self,
+        webhook_url: Optional[str] = None,
+        sns_region: Optional[str] = None,
+        *,
+        workers: int = 4,
+        queue_size: int = 1000,
+        retries: int = 3,
+        backoff: float = 0.2,
+        timeout: float = 5.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        sns_factory: Optional[Callable[[], Any]] = None,
+    ):
+        self.webhook_url = webhook_url
+        self.sns_region = sns_region
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._transport = transport
+        self._sns_factory = sns_factory or (lambda: boto3.client("sns", region_name=self.sns_region))
+        self._sns = None
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._http: Optional[httpx.AsyncClient] = None
+        self.breakers = {"n8n": CircuitBreaker(), "sns": CircuitBreaker()}
+        self.metrics = {name: ChannelMetrics() for name in ("n8n", "sns", "logged")}
+
+    @classmethod
+    def from_env(cls) -> "OtpDeliveryService":
+        return cls(
+            webhook_url=os.environ.get("N8N_OTP_WEBHOOK_URL"),
+            sns_region=os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION"),
+            workers=int(os.environ.get("OTP_DELIVERY_WORKERS", "4")),
+            queue_size=int(os.environ.get("OTP_DELIVERY_QUEUE_SIZE", "1000")),
+            retries=int(os.environ.get("OTP_DELIVERY_RETRIES", "3")),
+        )
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._http = httpx.AsyncClient(
+            transport=self._transport,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.workers, max_keepalive_connections=self.workers),
+        )
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def enqueue(self, job: OtpDeliveryJob):
+        self.start()
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull as ex:
+            raise DeliveryQueueFull("OTP delivery queue is full") from ex
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def aclose(self, drain_timeout: float = 10.0):
+        """Deliver what is queued (up to ``drain_timeout`` s), then stop the workers."""
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Dropping {self._queue.qsize()} undelivered OTP jobs on shutdown")
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks = []
+            self._queue = None
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.depth,
+            "channels": {name: m.snapshot() for name, m in self.metrics.items()},
+            "breakers": {name: b.state for name, b in self.breakers.items()},
+        }
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self.deliver(job)
+            except Exception as ex:
+                logger.error(f"OTP delivery crashed for {job.e164}: {ex}")
+            finally:
+                self._queue.task_done()
+
+    async def deliver(self, job: OtpDeliveryJob) -> str:
+        """Try each configured channel in order; returns the one that succeeded."""
+        if self.webhook_url and await self._attempt("n8n", self._send_n8n, job):
+            return "n8n"
+        if self.sns_region and await self._attempt("sns", self._send_sns, job):
+            return "sns"
+        started = time.perf_counter()
+        logger.info(f"Mobile OTP for {job.e164}: {job.code}")
+        self.metrics["logged"].observe(True, (time.perf_counter() - started) * 1000)
+        return "logged"
+
+    async def _attempt(self, channel: str, send, job: OtpDeliveryJob) -> bool:
+        breaker = self.breakers[channel]
+        for attempt in range(self.retries):
+            if not breaker.allow():
+                return False
+            started = time.perf_counter()
+            try:
+                await send(job)
+            except Exception as ex:
+                self.metrics[channel].observe(False, (time.perf_counter() - started) * 1000)
+                breaker.record_failure()
+                logger.warning(f"{channel} OTP send failed (attempt {attempt + 1}/{self.retries}): {ex}")
+                if attempt + 1 < self.retries:
+                    await asyncio.sleep(self.backoff * 2 ** attempt * (0.5 + random.random()))
+                continue
+            self.metrics[channel].observe(True, (time.perf_counter() - started) * 1000)
+            breaker.record_success()
+            return True
+        return False
+
+    async def _send_n8n(self, job: OtpDeliveryJob):
+        resp = await self._http.post(
+            self.webhook_url,
+            json={"mobile_number": job.mobile_number, "e164": job.e164, "otp": job.code},
+        )
+        if not 200 <= resp.status_code < 300:
+            raise RuntimeError(f"n8n webhook responded with {resp.status_code}: {resp.text}")
+
+    def _sns_client(self):
+        if self._sns is None:
+            self._sns = self._sns_factory()
+        return self._sns
+
+    async def _send_sns(self, job: OtpDeliveryJob):
+        attrs = {
+            'AWS.SNS.SMS.SMSType': {'DataType': 'String', 'StringValue': os.environ.get("SNS_SMS_TYPE", "Transactional")},
+        }
+        sender_id = os.environ.get("SNS_SENDER_ID")
+        if sender_id:
+            attrs['AWS.SNS.SMS.SenderID'] = {'DataType': 'String', 'StringValue': sender_id[:11]}
+        # boto3 is blocking; the client is thread-safe and reused across sends
+        await asyncio.to_thread(
+            self._sns_client().publish,
+            PhoneNumber=job.e164,
+            Message=f"Your OTP code is {job.code}. It expires in 5 minutes.",
+            MessageAttributes=attrs,
+        )
@@ -0,0 +1,190 @@
+"""OTP storage backends.
+
+``MemoryOtpStore`` keeps codes in the worker process and expires them with a
+hashed timer wheel; ``RedisOtpStore`` shares codes between workers and lets
+the server expire keys. Both verify with a single atomic check-and-consume:
+a wrong code bumps the attempt counter, the right one deletes the entry.
+"""
+import math
+import os
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # optional, only needed for OTP_STORE=redis
+    aioredis = None
+
+MAX_ATTEMPTS = int(os.environ.get("OTP_MAX_ATTEMPTS", "5"))
+
+Key = Tuple[str, str]
+
+
+class TimerWheel:
+    """Hashed timer wheel: deadlines hash into ``slots`` buckets of ``tick`` seconds.
+
+    Scheduling and cancelling are O(1); :meth:`advance` only visits the
+    buckets whose ticks have passed since the previous call.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512, now: Optional[float] = None):
+        self.tick = tick
+        self.slots = slots
+        self._buckets: List[Dict[Key, float]] = [{} for _ in range(slots)]
+        self._slot_of: Dict[Key, int] = {}
+        self._current = int((time.monotonic() if now is None else now) // tick)
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def schedule(self, key: Key, deadline: float):
+        self.cancel(key)
+        # Round up so the bucket is visited at or after the deadline
+        slot = math.ceil(deadline / self.tick) % self.slots
+        self._buckets[slot][key] = deadline
+        self._slot_of[key] = slot
+
+    def cancel(self, key: Key):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            self._buckets[slot].pop(key, None)
+
+    def advance(self, now: float) -> Set[Key]:
+        """Remove and return every key whose deadline is <= ``now``."""
+        target = int(now // self.tick)
+        if target <= self._current:
+            return set()
+        if target - self._current >= self.slots:
+            slots = range(self.slots)  # idle for a full turn: sweep everything once
+        else:
+            slots = (t % self.slots for t in range(self._current + 1, target + 1))
+        self._current = target
+        expired = set()
+        for slot in slots:
+            bucket = self._buckets[slot]
+            # Entries further out than one turn share the bucket; keep them
+            due = [key for key, deadline in bucket.items() if deadline <= now]
+            for key in due:
+                del bucket[key]
+                del self._slot_of[key]
+            expired.update(due)
+        return expired
+
+
+class MemoryOtpStore:
+    """Per-process OTP store. Operations never await, so each is atomic on the loop."""
+
+    def __init__(self, max_attempts: int = MAX_ATTEMPTS, wheel: Optional[TimerWheel] = None):
+        self.max_attempts = max_attempts
+        self.wheel = wheel or TimerWheel()
+        self._entries: Dict[Key, Tuple[str, float, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self, now: float):
+        for key in self.wheel.advance(now):
+            self._entries.pop(key, None)
+
+    async def put(self, target: str, kind: str, code: str, ttl_seconds: int):
+        now = time.monotonic()
+        self._expire(now)
+        key = (target, kind)
+        self._entries[key] = (str(code), now + ttl_seconds, 0)
+        self.wheel.schedule(key, now + ttl_seconds)
+
+    async def check_and_consume(self, target: str, kind: str, code: str) -> bool:
+        now = time.monotonic()
+        self._expire(now)
+        key = (target, kind)
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        expected, expires_at, attempts = entry
+        if now >= expires_at:
+            self._discard(key)
+            return False
+        if expected != str(code):
+            attempts += 1
+            if attempts >= self.max_attempts:
+                self._discard(key)
+            else:
+                self._entries[key] = (expected, expires_at, attempts)
+            return False
+        self._discard(key)
+        return True
+
+    def _discard(self, key: Key):
+        self._entries.pop(key, None)
+        self.wheel.cancel(key)
+
+    async def aclose(self):
+        self._entries.clear()
+
+
+# KEYS[1] = otp hash; ARGV[1] = submitted code, ARGV[2] = max attempts
+_CHECK_AND_CONSUME = """
+local code = redis.call('HGET', KEYS[1], 'code')
+if not code then return 0 end
+if code == ARGV[1] then
+  redis.call('DEL', KEYS[1])
+  return 1
+end
+local attempts = redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+if attempts >= tonumber(ARGV[2]) then redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class RedisOtpStore:
+    """OTP store shared by all workers through Redis (or a compatible server)."""
+
+    def __init__(self, client, max_attempts: int = MAX_ATTEMPTS, prefix: str = "otp"):
+        self.client = client
+        self.max_attempts = max_attempts
+        self.prefix = prefix
+        self._check = client.register_script(_CHECK_AND_CONSUME)
+
+    def _key(self, target: str, kind: str) -> str:
+        return f"{self.prefix}:{kind}:{target}"
+
+    async def put(self, target: str, kind: str, code: str, ttl_seconds: int):
+        key = self._key(target, kind)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping={"code": str(code), "attempts": 0})
+            pipe.expire(key, ttl_seconds)
+            await pipe.execute()
+
+    async def check_and_consume(self, target: str, kind: str, code: str) -> bool:
+        result = await self._check(keys=[self._key(target, kind)], args=[str(code), self.max_attempts])
+        return int(result) == 1
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def configured_workers() -> int:
+    """Worker processes announced by the server (WEB_CONCURRENCY or UVICORN_WORKERS)."""
+    for name in ("WEB_CONCURRENCY", "UVICORN_WORKERS"):
+        value = os.environ.get(name)
+        if value:
+            return int(value)
+    return 1
+
+
+def otp_store_from_env():
+    """Build the store selected by OTP_STORE (memory, the default, or redis).
+
+    The memory store is per process: a code sent by one worker could not be
+    verified by another, so it refuses to start with more than one worker.
+    """
+    if os.environ.get("OTP_STORE", "memory") == "redis":
+        if aioredis is None:
+            raise RuntimeError("OTP_STORE=redis requires the redis package")
+        client = aioredis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379/0"), decode_responses=True)
+        return RedisOtpStore(client)
+    workers = configured_workers()
+    if workers > 1:
+        raise RuntimeError(f"OTP_STORE=memory cannot be shared by {workers} workers; set OTP_STORE=redis")
+    return MemoryOtpStore()
@@ -0,0 +1,135 @@
+"""Compiled profession rules.
+
+``professions.json`` lists, per profession, the documents that are
+required to register and the optional documents that make a provider
+"Professional" rather than "Amateur/Freelancer". At load time every
+document gets a bit, every profession becomes a (required, optional) pair
+of bitmasks, and a whole profession list is evaluated with a few mask
+operations. Results are memoised per (professions, documents) since the
+same combinations repeat across registrations.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+PROFESSIONAL = "Professional"
+AMATEUR = "Amateur/Freelancer"
+
+logger = logging.getLogger(__name__)
+
+
+class Evaluation:
+    __slots__ = ("error", "status")
+
+    def __init__(self, error: Optional[str], status: Dict[str, str]):
+        self.error = error
+        self.status = status
+
+
+class RuleTable:
+    """Immutable rule table compiled from a professions config mapping."""
+
+    def __init__(self, config: dict):
+        self.document_labels: Dict[str, str] = dict(config["documents"])
+        self.document_bits = {name: 1 << i for i, name in enumerate(self.document_labels)}
+        self.rules: Dict[str, Tuple[int, int]] = {}
+        for profession, spec in config["professions"].items():
+            self.rules[profession] = (
+                self.mask(spec.get("required", [])),
+                self.mask(spec.get("optional", [])),
+            )
+        self._evaluate = lru_cache(maxsize=4096)(self._evaluate_uncached)
+
+    def mask(self, documents: Iterable[str]) -> int:
+        bits = 0
+        for name in documents:
+            bits |= self.document_bits[name]
+        return bits
+
+    def provided(self, **documents: bool) -> int:
+        """Bitmask of the documents passed as truthy keyword arguments."""
+        return self.mask(name for name, present in documents.items() if present)
+
+    def evaluate(self, professions: Sequence[str], provided: int) -> Evaluation:
+        """Validate a profession list and derive each profession's status."""
+        return self._evaluate(tuple(professions), provided)
+
+    def evaluate_many(self, rows: Iterable[Tuple[Sequence[str], int]]) -> List[Evaluation]:
+        return [self._evaluate(tuple(professions), provided) for professions, provided in rows]
+
+    def _evaluate_uncached(self, professions: Tuple[str, ...], provided: int) -> Evaluation:
+        rules = self.rules
+        required = 0
+        for profession in professions:
+            rule = rules.get(profession)
+            if rule is None:
+                return Evaluation(f"Invalid profession: {profession}", {})
+            required |= rule[0]
+        missing = required & ~provided
+        if missing:
+            # Report the first profession (in request order) that is missing a document
+            for profession in professions:
+                lacking = rules[profession][0] & missing
+                if lacking:
+                    document = next(name for name, bit in self.document_bits.items() if bit & lacking)
+                    label = profession.replace('_', ' ').title()
+                    return Evaluation(f"{self.document_labels[document]} is mandatory for {label}s", {})
+        status = {p: PROFESSIONAL if rules[p][1] & ~provided == 0 else AMATEUR for p in professions}
+        return Evaluation(None, status)
+
+    def catalog(self) -> List[dict]:
+        """Profession list as served by GET /api/professions"""
+        trade, health = self.document_bits["trade_license"], self.document_bits["health_permit"]
+        return [
+            {
+                "id": key,
+                "name": key.replace('_', ' ').title(),
+                "requires_trade_license": bool(required & trade),
+                "optional_trade_license": bool(optional & trade),
+                "optional_health_permit": bool(optional & health),
+            }
+            for key, (required, optional) in self.rules.items()
+        ]
+
+
+class ProfessionRules:
+    """Holds the current RuleTable and recompiles it when the config file changes."""
+
+    def __init__(self, path: Path, check_interval: float = 5.0):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = self.path.stat().st_mtime
+        self._checked_at = time.monotonic()
+        self.table = RuleTable(json.loads(self.path.read_text()))
+
+    def current(self) -> RuleTable:
+        """The rule table, reloaded first if the file changed (checked every few seconds)."""
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            try:
+                if self.reload():
+                    logger.info(f"Reloaded profession rules from {self.path}")
+            except (OSError, ValueError, KeyError) as ex:
+                logger.error(f"Keeping previous profession rules, reload failed: {ex}")
+        return self.table
+
+    def reload(self, force: bool = False) -> bool:
+        with self._lock:
+            mtime = self.path.stat().st_mtime
+            if not force and mtime == self._mtime:
+                return False
+            # Compile first so a bad file leaves the previous table in place
+            table = RuleTable(json.loads(self.path.read_text()))
+            self.table, self._mtime = table, mtime
+            return True
+
+
+def rules_from_env(default_path: Path) -> ProfessionRules:
+    return ProfessionRules(Path(os.environ.get("PROFESSION_RULES_PATH", default_path)))
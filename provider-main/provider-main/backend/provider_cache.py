@@ -0,0 +1,227 @@
+"""Read-through cache for provider rows keyed by ``provider_id``.
+
+Each provider can have one entry per read view (summary, detail, ...).
+Entries live in a per-worker LRU bounded by their serialised size and
+expire after a TTL. Writes that change a provider invalidate all of its
+views explicitly. An optional shared Redis tier lets workers fill each other's
+misses; it keeps a generation counter per provider that invalidation bumps,
+and a row loaded before the bump is not written back, so a slow load can
+never repopulate the shared tier with a pre-update row. Another worker's
+local copy can stay stale until its (shorter) local TTL runs out.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # optional, only needed for PROVIDER_CACHE_STORE=redis
+    aioredis = None
+
+Row = Dict[str, Any]
+Key = Tuple[str, str]  # (provider_id, view)
+
+
+class ProviderCache:
+    """Size-bounded LRU + TTL cache with single-flight loads."""
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl: float = 60.0, shared=None, shared_ttl: int = 300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self._entries: "OrderedDict[Key, Tuple[float, int, Row]]" = OrderedDict()
+        self._views: Dict[str, Set[str]] = {}
+        self._bytes = 0
+        self._loading: Dict[Key, asyncio.Future] = {}
+        self._stale: Set[str] = set()  # invalidated while a load was in flight
+        self.hits = self.misses = self.coalesced = self.shared_hits = 0
+        self.evictions = self.expirations = self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, provider_id: str, view: str = "full") -> Optional[Row]:
+        key = (provider_id, view)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, _, row = entry
+        if time.monotonic() >= expires_at:
+            self._drop(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return row
+
+    def put(self, provider_id: str, row: Row, size: Optional[int] = None, view: str = "full"):
+        size = size if size is not None else len(json.dumps(row, default=str))
+        if size > self.max_bytes:
+            return
+        key = (provider_id, view)
+        self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, row)
+        self._views.setdefault(provider_id, set()).add(view)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key: Key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+            views = self._views.get(key[0])
+            if views is not None:
+                views.discard(key[1])
+                if not views:
+                    del self._views[key[0]]
+
+    async def invalidate(self, provider_id: str):
+        """Drop every cached view of a provider."""
+        for view in list(self._views.get(provider_id, ())):
+            self._drop((provider_id, view))
+        self.invalidations += 1
+        if any(pid == provider_id for pid, _ in self._loading):
+            self._stale.add(provider_id)
+        if self.shared is not None:
+            await self.shared.delete(provider_id)
+
+    async def get_or_load(self, provider_id: str, load: Callable[[], Awaitable[Optional[Row]]], view: str = "full") -> Optional[Row]:
+        """Cached row, else ``load()`` once for all concurrent callers. Misses are not cached."""
+        row = self.get(provider_id, view)
+        if row is not None:
+            self.hits += 1
+            return row
+        key = (provider_id, view)
+        pending = self._loading.get(key)
+        if pending is not None:
+            # Waits for the in-flight load: neither a hit nor another load
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            row = await self._load(provider_id, view, load)
+        except BaseException as ex:
+            future.set_exception(ex)
+            future.exception()
+            raise
+        finally:
+            self._loading.pop(key, None)
+            if not any(pid == provider_id for pid, _ in self._loading):
+                self._stale.discard(provider_id)
+        future.set_result(row)
+        return row
+
+    async def _load(self, provider_id: str, view: str, load) -> Optional[Row]:
+        generation = None
+        if self.shared is not None:
+            raw = await self.shared.get(provider_id, view)
+            if raw is not None:
+                self.shared_hits += 1
+                row = json.loads(raw)
+                if provider_id not in self._stale:
+                    self.put(provider_id, row, len(raw), view)
+                return row
+            # Read before loading: an invalidation on any worker after this
+            # point makes the loaded row too old for the shared tier
+            generation = await self.shared.generation(provider_id)
+        row = await load()
+        if row is not None and provider_id not in self._stale:
+            raw = json.dumps(row, default=str)
+            self.put(provider_id, row, len(raw), view)
+            if self.shared is not None:
+                await self.shared.set(provider_id, view, raw, self.shared_ttl, generation)
+        return row
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "shared_hits": self.shared_hits,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+    async def aclose(self):
+        self._entries.clear()
+        self._views.clear()
+        self._bytes = 0
+        if self.shared is not None:
+            await self.shared.aclose()
+
+
+# Write a view only if no invalidation happened since the loader read the generation
+_SET_IF_GENERATION = """
+if tonumber(redis.call('GET', KEYS[2]) or '0') ~= tonumber(ARGV[1]) then return 0 end
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+
+class RedisCacheTier:
+    """Shared second tier: one Redis hash per provider, one field per view.
+
+    ``<prefix>:<id>:gen`` counts invalidations; it outlives the cached rows
+    (``generation_ttl``) so a load cannot span a reset of the counter.
+    """
+
+    def __init__(self, client, prefix: str = "provider", generation_ttl: int = 86400):
+        self.client = client
+        self.prefix = prefix
+        self.generation_ttl = generation_ttl
+        self._set = client.register_script(_SET_IF_GENERATION)
+
+    def _keys(self, provider_id: str) -> Tuple[str, str]:
+        key = f"{self.prefix}:{provider_id}"
+        return key, f"{key}:gen"
+
+    async def get(self, provider_id: str, view: str) -> Optional[str]:
+        return await self.client.hget(self._keys(provider_id)[0], view)
+
+    async def generation(self, provider_id: str) -> int:
+        return int(await self.client.get(self._keys(provider_id)[1]) or 0)
+
+    async def set(self, provider_id: str, view: str, raw: str, ttl: int, generation: int) -> bool:
+        """Store a view loaded at ``generation``; skipped if the provider was invalidated since."""
+        return bool(await self._set(keys=list(self._keys(provider_id)), args=[generation, view, raw, ttl]))
+
+    async def delete(self, provider_id: str):
+        key, gen = self._keys(provider_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.incr(gen)
+            pipe.expire(gen, self.generation_ttl)
+            pipe.delete(key)
+            await pipe.execute()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def provider_cache_from_env() -> ProviderCache:
+    """Build the cache configured by PROVIDER_CACHE_* environment variables."""
+    max_bytes = int(os.environ.get("PROVIDER_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    ttl = float(os.environ.get("PROVIDER_CACHE_TTL", "60"))
+    shared = None
+    if os.environ.get("PROVIDER_CACHE_STORE", "memory") == "redis":
+        if aioredis is None:
+            raise RuntimeError("PROVIDER_CACHE_STORE=redis requires the redis package")
+        client = aioredis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379/0"), decode_responses=True)
+        shared = RedisCacheTier(client)
+        # Other workers only see invalidations through the shared tier
+        ttl = float(os.environ.get("PROVIDER_CACHE_LOCAL_TTL", "5"))
+    return ProviderCache(max_bytes=max_bytes, ttl=ttl, shared=shared)
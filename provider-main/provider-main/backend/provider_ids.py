@@ -0,0 +1,135 @@
+"""Query-free provider ID allocation.
+
+Provider IDs keep the ``123456A`` format (6 digits + 1 letter, 26M values).
+A counter is mapped through a keyed Feistel permutation of that space, so
+IDs look random but never repeat. Workers reserve blocks of counter values
+from a shared source and hand out IDs from their block without touching
+the ``providers`` table.
+"""
+import asyncio
+import fcntl
+import hashlib
+import hmac
+import math
+import os
+import string
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+ID_SPACE = 10 ** 6 * 26
+_HALF = math.isqrt(ID_SPACE - 1) + 1  # Feistel runs on _HALF x _HALF >= ID_SPACE
+ROUNDS = 6
+
+
+class ProviderIdPermutation:
+    """Keyed bijection on [0, ID_SPACE) (balanced Feistel + cycle walking)."""
+
+    def __init__(self, key: bytes):
+        self.key = key
+
+    def _round(self, value: int, i: int) -> int:
+        digest = hmac.new(self.key, f"{i}:{value}".encode(), hashlib.sha256).digest()
+        return int.from_bytes(digest[:8], "big") % _HALF
+
+    def _feistel(self, x: int) -> int:
+        left, right = divmod(x, _HALF)
+        for i in range(ROUNDS):
+            left, right = right, (left + self._round(right, i)) % _HALF
+        return left * _HALF + right
+
+    def permute(self, index: int) -> int:
+        if not 0 <= index < ID_SPACE:
+            raise ValueError("index outside provider ID space")
+        x = self._feistel(index)
+        while x >= ID_SPACE:
+            x = self._feistel(x)
+        return x
+
+
+def format_provider_id(value: int) -> str:
+    digits, letter = divmod(value, 26)
+    return f"{digits:06d}{string.ascii_uppercase[letter]}"
+
+
+class FileBlockSource:
+    """Reserves counter blocks from a flock-protected file (workers on one host)."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def _reserve(self, size: int) -> Tuple[int, int]:
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                start = int(f.read().strip() or 0)
+                f.seek(0)
+                f.truncate()
+                f.write(str(start + size))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return start, start + size
+
+    async def reserve(self, size: int) -> Tuple[int, int]:
+        return await asyncio.to_thread(self._reserve, size)
+
+
+class DatabaseBlockSource:
+    """Reserves counter blocks through the ``reserve_provider_id_block`` RPC (multi-host)."""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def reserve(self, size: int) -> Tuple[int, int]:
+        res = await self.db.execute(self.db.rpc("reserve_provider_id_block", {"block_size": size}))
+        start = int(res.data)
+        return start, start + size
+
+
+class ProviderIdAllocator:
+    """Hands out unique provider IDs from reserved counter blocks."""
+
+    def __init__(self, source, key: bytes, block_size: int = 100):
+        self.source = source
+        self.permutation = ProviderIdPermutation(key)
+        self.block_size = block_size
+        self._next: Optional[int] = None
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def allocate(self) -> str:
+        return (await self.allocate_many(1))[0]
+
+    async def allocate_many(self, count: int) -> List[str]:
+        """Allocate ``count`` IDs, reserving one large block if the current one is short."""
+        counters: List[int] = []
+        async with self._lock:
+            while len(counters) < count:
+                if self._next is None or self._next >= self._end:
+                    self._next, self._end = await self.source.reserve(max(self.block_size, count - len(counters)))
+                take = min(self._end - self._next, count - len(counters))
+                counters.extend(range(self._next, self._next + take))
+                self._next += take
+        if counters and counters[-1] >= ID_SPACE:
+            raise RuntimeError("Provider ID space exhausted")
+        return [format_provider_id(self.permutation.permute(c)) for c in counters]
+
+
+def allocator_from_env(db, state_dir: Path) -> ProviderIdAllocator:
+    """Build the allocator configured by PROVIDER_ID_* environment variables.
+
+    PROVIDER_ID_KEY is required: IDs issued under one key must keep their
+    permutation, so it cannot follow rotations of another secret.
+    """
+    key = os.environ.get("PROVIDER_ID_KEY")
+    if not key:
+        raise RuntimeError("PROVIDER_ID_KEY must be set to a dedicated secret")
+    block_size = int(os.environ.get("PROVIDER_ID_BLOCK_SIZE", "100"))
+    if os.environ.get("PROVIDER_ID_SOURCE", "file") == "database":
+        source = DatabaseBlockSource(db)
+    else:
+        source = FileBlockSource(state_dir / "provider_id.counter")
+    return ProviderIdAllocator(source, hashlib.sha256(key.encode()).digest(), block_size)
@@ -0,0 +1,169 @@
+"""Token-bucket rate limiting for abuse-prone routes.
+
+Limits are keyed by ``<route>:<dimension>:<value>`` (e.g. the caller's IP or
+mobile number). ``MemoryRateLimiter`` keeps buckets in the worker process,
+spread over lock-striped shards so threadpool handlers don't contend on a
+single lock; ``RedisRateLimiter`` shares buckets between workers. Both
+answer with the seconds to wait, so a rejection costs no other I/O.
+"""
+import math
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from fastapi.responses import JSONResponse
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # optional, only needed for RATE_LIMIT_STORE=redis
+    aioredis = None
+
+
+class _Shard:
+    __slots__ = ("lock", "buckets")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+
+class MemoryRateLimiter:
+    """In-process token buckets; idle keys are evicted LRU-first past ``max_keys``."""
+
+    def __init__(self, shards: int = 64, max_keys: int = 100_000):
+        self._shards = [_Shard() for _ in range(shards)]
+        self._per_shard = max(1, max_keys // shards)
+
+    def _take(self, key: str, capacity: int, per_seconds: float, now: float) -> float:
+        shard = self._shards[zlib.crc32(key.encode()) % len(self._shards)]
+        rate = capacity / per_seconds
+        with shard.lock:
+            tokens, last = shard.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            if tokens >= 1:
+                wait, tokens = 0.0, tokens - 1
+            else:
+                wait = (1 - tokens) / rate
+            shard.buckets[key] = (tokens, now)
+            if len(shard.buckets) > self._per_shard:
+                shard.buckets.popitem(last=False)
+        return wait
+
+    async def hit(self, key: str, capacity: int, per_seconds: float) -> float:
+        """Take one token; returns 0 if allowed, else seconds until one is available."""
+        return self._take(key, capacity, per_seconds, time.monotonic())
+
+    async def aclose(self):
+        pass
+
+
+# KEYS[1] = bucket; ARGV = capacity, refill per ms
+_TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate))
+return tostring(wait)
+"""
+
+
+class RedisRateLimiter:
+    """Token buckets shared by all workers through Redis (or a compatible server)."""
+
+    def __init__(self, client, prefix: str = "rl"):
+        self.client = client
+        self.prefix = prefix
+        self._bucket = client.register_script(_TOKEN_BUCKET)
+
+    async def hit(self, key: str, capacity: int, per_seconds: float) -> float:
+        wait_ms = await self._bucket(keys=[f"{self.prefix}:{key}"], args=[capacity, capacity / (per_seconds * 1000)])
+        return float(wait_ms) / 1000
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a caller is over a route limit."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class RateLimits:
+    """Per-route limits: {route: {dimension: (capacity, per_seconds)}}."""
+
+    def __init__(self, limiter, rules: Dict[str, Dict[str, Tuple[int, float]]], enabled: bool = True):
+        self.limiter = limiter
+        self.rules = rules
+        self.enabled = enabled
+
+    async def retry_after(self, route: str, dimension: str, value: str) -> float:
+        """Seconds the caller must wait, or 0 if this request is within the limit."""
+        rule = self.rules.get(route, {}).get(dimension)
+        if not self.enabled or rule is None or not value:
+            return 0.0
+        capacity, per_seconds = rule
+        return await self.limiter.hit(f"{route}:{dimension}:{value}", capacity, per_seconds)
+
+    async def enforce(self, route: str, dimension: str, value: str):
+        wait = await self.retry_after(route, dimension, value)
+        if wait:
+            raise RateLimitExceeded(wait)
+
+    async def aclose(self):
+        await self.limiter.aclose()
+
+
+def rate_limiter_from_env():
+    """Build the limiter selected by RATE_LIMIT_STORE (memory, the default, or redis)."""
+    if os.environ.get("RATE_LIMIT_STORE", "memory") == "redis":
+        if aioredis is None:
+            raise RuntimeError("RATE_LIMIT_STORE=redis requires the redis package")
+        return RedisRateLimiter(aioredis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379/0"), decode_responses=True))
+    return MemoryRateLimiter()
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying the ``ip`` dimension before the body is read."""
+
+    def __init__(self, app, limits: RateLimits, paths: Dict[str, str], trust_proxy: bool = False):
+        self.app = app
+        self.limits = limits
+        self.paths = paths
+        self.trust_proxy = trust_proxy
+
+    def client_ip(self, scope) -> str:
+        if self.trust_proxy:
+            for name, value in scope.get("headers", []):
+                if name == b"x-forwarded-for":
+                    return value.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else ""
+
+    async def __call__(self, scope, receive, send):
+        route = self.paths.get(scope.get("path", "")) if scope["type"] == "http" and scope.get("method") == "POST" else None
+        if route is not None:
+            wait = await self.limits.retry_after(route, "ip", self.client_ip(scope))
+            if wait:
+                exc = RateLimitExceeded(wait)
+                response = JSONResponse(status_code=429, content={"detail": "Too many requests"}, headers=exc.headers)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
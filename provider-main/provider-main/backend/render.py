@@ -0,0 +1,139 @@
+"""QR code and ID card rendering off the event loop.
+
+Rendering runs in a process pool. Each worker caches its fonts and the
+static card template, and hands the QR image to the card stage in memory
+instead of re-decoding a base64 PNG. Results are memoised per
+(provider_id, mobile, professions) in the parent process.
+"""
+import asyncio
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+
+CARD_SIZE = (600, 400)
+QR_SIZE = (120, 120)
+QR_POSITION = (450, 50)
+
+
+@lru_cache(maxsize=1)
+def _fonts() -> Tuple[ImageFont.ImageFont, ImageFont.ImageFont]:
+    """Title and text fonts (fallback to default if not available)"""
+    return ImageFont.load_default(), ImageFont.load_default()
+
+
+@lru_cache(maxsize=1)
+def _card_template() -> Image.Image:
+    """Blank card with the static parts already drawn"""
+    card = Image.new('RGB', CARD_SIZE, color='white')
+    title_font, text_font = _fonts()
+    draw = ImageDraw.Draw(card)
+    draw.text((20, 20), "SERVICE PROVIDER ID", fill='black', font=title_font)
+    draw.text((20, 150), "Status: VERIFIED", fill='green', font=text_font)
+    return card
+
+
+def _png(img) -> bytes:
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def render_qr(provider_id: str, mobile: str):
+    """Build the provider QR code image"""
+    qr_data = {
+        "provider_id": provider_id,
+        "mobile": mobile,
+        "verified": True,
+        "generated_at": datetime.now(timezone.utc).isoformat()
+    }
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(json.dumps(qr_data))
+    qr.make(fit=True)
+    return qr.make_image(fill_color="black", back_color="white").get_image()
+
+
+def render_card(provider_id: str, mobile: str, professions: List[str], qr_img: Image.Image) -> Image.Image:
+    """Draw the ID card on a copy of the cached template"""
+    card = _card_template().copy()
+    _, text_font = _fonts()
+    draw = ImageDraw.Draw(card)
+    draw.text((20, 60), f"ID: {provider_id}", fill='black', font=text_font)
+    draw.text((20, 90), f"Mobile: {mobile}", fill='black', font=text_font)
+    draw.text((20, 120), f"Professions: {', '.join(professions)}", fill='black', font=text_font)
+    card.paste(qr_img.resize(QR_SIZE), QR_POSITION)
+    return card
+
+
+def render_provider_assets(provider_id: str, mobile: str, professions: List[str]) -> Tuple[bytes, bytes]:
+    """Render (qr_png, id_card_png) for a provider. Runs inside pool workers."""
+    qr_img = render_qr(provider_id, mobile)
+    card = render_card(provider_id, mobile, professions, qr_img)
+    return _png(qr_img), _png(card)
+
+
+def _warm_worker():
+    _fonts()
+    _card_template()
+
+
+class RenderEngine:
+    """Process-pool renderer with an LRU memo and in-flight de-duplication."""
+
+    def __init__(self, workers: Optional[int] = None, cache_size: int = 1024):
+        self.workers = int(os.environ.get("RENDER_WORKERS", workers if workers is not None else os.cpu_count() or 1))
+        self.cache_size = cache_size
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._cache: "OrderedDict[tuple, Tuple[bytes, bytes]]" = OrderedDict()
+        self._pending: Dict[tuple, asyncio.Future] = {}
+
+    def _executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+        return self._pool
+
+    async def render(self, provider_id: str, mobile: str, professions: List[str]) -> Tuple[bytes, bytes]:
+        key = (provider_id, mobile, tuple(professions))
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[key] = future
+        try:
+            executor = self._executor()
+            if executor is None:
+                result = await asyncio.to_thread(render_provider_assets, provider_id, mobile, list(professions))
+            else:
+                result = await loop.run_in_executor(executor, render_provider_assets, provider_id, mobile, list(professions))
+        except BaseException as ex:
+            future.set_exception(ex)
+            # Mark retrieved so waiters-less failures don't log "never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._pending.pop(key, None)
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        future.set_result(result)
+        return result
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
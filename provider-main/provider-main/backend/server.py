@@ -1,37 +1,100 @@
-from fastapi import FastAPI, APIRouter, File, UploadFile, Form, HTTPException
-from fastapi.responses import FileResponse, Response
+from fastapi import FastAPI, APIRouter, File, UploadFile, Form, Header, HTTPException, Request, Query
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from supabase import create_client, Client
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, EmailStr, ValidationError
+from typing import BinaryIO, Iterator, List, Optional, Dict, Any, Tuple
 import uuid
-from datetime import datetime, timezone, timedelta
-import boto3
+from datetime import datetime, timezone
 import re
+import tempfile
+import asyncio
 import base64
-import qrcode
-from io import BytesIO
+import csv
+import hashlib
 import random
 import string
-from PIL import Image, ImageDraw, ImageFont
 import json
-import requests
+
+from db import SupabaseDB, ProviderRepository, DatabaseTimeout, ProviderConflict
+from postgrest.exceptions import APIError
+import fastjson
+from docstore import DocumentStore, CONTENT_ID_PREFIX, blob_key
+from http_cache import PrecomputedJSON, binary_response
+from ingest import ingest_documents, document_ids, index_entries, total_size, UploadTooLarge
+from otp_delivery import OtpDeliveryService, OtpDeliveryJob, DeliveryQueueFull
+from otp_store import otp_store_from_env
+from rate_limit import RateLimits, RateLimitExceeded, RateLimitMiddleware, rate_limiter_from_env
+from render import RenderEngine
+from email_verification import email_verification_from_env
+from wallet import WalletLedger, WalletError, WalletProviderNotFound, parse_amount, wallet_from_env
+from profession_rules import rules_from_env
+from provider_cache import provider_cache_from_env
+from provider_ids import allocator_from_env
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# Supabase connection
+# Supabase connection (async PostgREST over a shared keep-alive pool)
 SUPABASE_URL = os.environ['SUPABASE_URL']
 SUPABASE_SERVICE_ROLE_KEY = os.environ['SUPABASE_SERVICE_ROLE_KEY']
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+db = SupabaseDB(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+providers_repo = ProviderRepository(db)
 
-# Create upload directory
+# Create upload directory (content-addressed document store)
 upload_dir = Path("uploads")
 upload_dir.mkdir(exist_ok=True)
+doc_store = DocumentStore(upload_dir)
+
+# OTP codes (in-process timer wheel or shared Redis, see OTP_STORE)
+otp_store = otp_store_from_env()
+otp_delivery = OtpDeliveryService.from_env()
+
+# Provider rows by provider_id (LRU + TTL, optional shared Redis tier)
+provider_cache = provider_cache_from_env()
+
+async def cached_provider(provider_id: str, view: str = "full") -> Optional[Dict[str, Any]]:
+    """Provider row with only the columns of ``view`` (see PROVIDER_VIEWS)"""
+    columns = ",".join(PROVIDER_VIEWS[view])
+    return await provider_cache.get_or_load(provider_id, lambda: providers_repo.get(provider_id, columns), view)
+
+async def invalidate_providers(rows: List[Dict[str, Any]]):
+    for row in rows:
+        if row.get("provider_id"):
+            await provider_cache.invalidate(row["provider_id"])
+
+# Wallet ledger (single RPC per change, optional credit coalescing)
+wallet_ledger = WalletLedger(db)
+wallet_writer = wallet_from_env(wallet_ledger)
+# Email-verified updates are batched into one RPC per flush window
+email_verification = email_verification_from_env(db)
+
+# Token-bucket limits per route: dimension -> (requests, per seconds)
+RATE_LIMITS = {
+    "otp_send": {"ip": (20, 60), "mobile": (3, 60)},
+    "otp_verify": {"ip": (60, 60), "mobile": (10, 60)},
+    "register": {"ip": (30, 60), "mobile": (5, 3600)},
+}
+RATE_LIMITED_PATHS = {
+    "/api/otp/send": "otp_send",
+    "/api/otp/verify": "otp_verify",
+    "/api/register": "register",
+    "/api/register/json": "register",
+}
+rate_limits = RateLimits(
+    rate_limiter_from_env(),
+    RATE_LIMITS,
+    enabled=os.environ.get("RATE_LIMIT_ENABLED", "true").lower() != "false",
+)
+
+# QR code / ID card renderer (process pool + memo)
+render_engine = RenderEngine()
+
+# Provider ID allocator (keyed permutation over reserved counter blocks)
+provider_id_allocator = allocator_from_env(db, upload_dir)
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -39,21 +102,9 @@ app = FastAPI()
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Profession definitions with requirements
-PROFESSIONS = {
-    "electrician": {"trade_license": False, "health_permit": False, "requires_trade_license": False},
-    "carpenter": {"trade_license": False, "health_permit": False, "requires_trade_license": False},
-    "plumber": {"trade_license": False, "health_permit": False, "requires_trade_license": False},
-    "locksmith": {"trade_license": True, "health_permit": False, "requires_trade_license": True},  # Mandatory
-    "gardener": {"trade_license": False, "health_permit": False, "requires_trade_license": False},
-    "photographer": {"trade_license": True, "health_permit": False, "requires_trade_license": False},  # Optional
-    "videographer": {"trade_license": True, "health_permit": False, "requires_trade_license": False},  # Optional
-    "hairstylist": {"trade_license": True, "health_permit": True, "requires_trade_license": False},  # Optional
-    "makeup_artist": {"trade_license": True, "health_permit": True, "requires_trade_license": False},  # Optional
-    "massage_therapist": {"trade_license": True, "health_permit": True, "requires_trade_license": False},  # Optional
-    "henna_artist": {"trade_license": True, "health_permit": True, "requires_trade_license": False},  # Optional
-    "caterer": {"trade_license": False, "health_permit": False, "requires_trade_license": False}
-}
+# Profession rules (compiled from professions.json, reloaded when it changes)
+profession_rules = rules_from_env(ROOT_DIR / "professions.json")
+professions_response = PrecomputedJSON(lambda: {"professions": profession_rules.current().catalog()})
 
 # Models
 class DocumentUpload(BaseModel):
@@ -83,122 +134,189 @@ class ProviderRegistration(BaseModel):
     # Face recognition
     face_photo: Optional[str] = None
 
-class Provider(BaseModel):
+# Read tiers: ProviderSummary < ProviderDetail < Provider (full, with media)
+class ProviderSummary(BaseModel):
+    """Identity, professions and status (~1 KB), e.g. for QR scans and dashboards"""
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     provider_id: str  # 6 digits + 1 letter (e.g., 123456A)
+    professions: List[str]
+    
+    # Professional status
+    professional_status: Dict[str, str] = {}  # profession -> "Professional" or "Amateur/Freelancer"
+    
+    # Verification
+    is_verified: bool = False
+    email_verified: bool = False
+
+class ProviderDetail(ProviderSummary):
+    """Everything except documents, QR code and ID card"""
     email: Optional[EmailStr] = None
     mobile_number: str
-    professions: List[str]
     
     # Document flags
     has_trade_license: bool = False
     has_health_permit: bool = False
     has_certificates: bool = False
     
-    # Professional status
-    professional_status: Dict[str, str] = {}  # profession -> "Professional" or "Amateur/Freelancer"
-    
-    # Documents (stored as file paths or base64)
-    documents: Dict[str, Any] = {}
-    
-    # Verification
-    is_verified: bool = False
     verification_date: Optional[datetime] = None
-    email_verified: bool = False
     email_verified_at: Optional[datetime] = None
     
     # Wallet
     wallet_balance: float = 0.0
     
-    # QR Code and ID Card
-    qr_code: Optional[str] = None
-    id_card_path: Optional[str] = None
-    
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
-def generate_provider_id():
-    """Generate unique 6-digit number + 1 letter ID"""
-    digits = ''.join(random.choices(string.digits, k=6))
-    letter = random.choice(string.ascii_uppercase)
-    return f"{digits}{letter}"
-
-def generate_qr_code(provider_id: str, mobile: str) -> str:
-    """Generate QR code for provider"""
-    qr_data = {
-        "provider_id": provider_id,
-        "mobile": mobile,
-        "verified": True,
-        "generated_at": datetime.now(timezone.utc).isoformat()
-    }
-    
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(json.dumps(qr_data))
-    qr.make(fit=True)
-    
-    qr_img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to base64
-    buffer = BytesIO()
-    qr_img.save(buffer, format='PNG')
-    qr_base64 = base64.b64encode(buffer.getvalue()).decode()
-    
-    return qr_base64
-
-def generate_id_card(provider_id: str, mobile: str, professions: List[str], qr_code_base64: str) -> str:
-    """Generate downloadable ID card"""
-    # Create ID card image
-    card_width, card_height = 600, 400
-    card = Image.new('RGB', (card_width, card_height), color='white')
-    draw = ImageDraw.Draw(card)
-    
-    try:
-        # Try to use a font (fallback to default if not available)
-        title_font = ImageFont.load_default()
-        text_font = ImageFont.load_default()
-    except:
-        title_font = ImageFont.load_default()
-        text_font = ImageFont.load_default()
-    
-    # Draw card content
-    draw.text((20, 20), "SERVICE PROVIDER ID", fill='black', font=title_font)
-    draw.text((20, 60), f"ID: {provider_id}", fill='black', font=text_font)
-    draw.text((20, 90), f"Mobile: {mobile}", fill='black', font=text_font)
-    draw.text((20, 120), f"Professions: {', '.join(professions)}", fill='black', font=text_font)
-    draw.text((20, 150), "Status: VERIFIED", fill='green', font=text_font)
-    
-    # Add QR code
-    qr_img_data = base64.b64decode(qr_code_base64)
-    qr_img = Image.open(BytesIO(qr_img_data))
-    qr_img = qr_img.resize((120, 120))
-    card.paste(qr_img, (450, 50))
-    
-    # Convert to base64
-    buffer = BytesIO()
-    card.save(buffer, format='PNG')
-    card_base64 = base64.b64encode(buffer.getvalue()).decode()
+class Provider(ProviderDetail):
+    # Documents (stored as file paths or base64)
+    documents: Dict[str, Any] = {}
     
-    return card_base64
+    # QR Code and ID Card
+    qr_code: Optional[str] = None
+    id_card_path: Optional[str] = None
 
-def determine_professional_status(profession: str, has_trade_license: bool, has_health_permit: bool) -> str:
-    """Determine if provider is Professional or Amateur/Freelancer"""
-    prof_requirements = PROFESSIONS.get(profession, {})
-    
-    # For professions that require specific documents
-    if profession in ['photographer', 'videographer', 'massage_therapist', 'hairstylist', 'henna_artist', 'makeup_artist']:
-        # If they haven't uploaded required documents, they're Amateur/Freelancer
-        if prof_requirements.get('trade_license') and not has_trade_license:
-            return "Amateur/Freelancer"
-        if prof_requirements.get('health_permit') and not has_health_permit:
-            return "Amateur/Freelancer"
-        return "Professional"
-    
-    return "Professional"  # Default for other professions
+# Columns selected per read view; heavy media fields are fetched lazily through their own views
+PROVIDER_VIEWS: Dict[str, List[str]] = {
+    "summary": list(ProviderSummary.model_fields),
+    "detail": list(ProviderDetail.model_fields),
+    "full": list(Provider.model_fields),
+    "qr_code": ["qr_code"],
+    "documents": ["documents"],
+    "id_card": ["id_card_path"],
+}
+VIEW_PATTERN = "^(summary|detail|full)$"
+
+async def generate_provider_id() -> str:
+    """Generate unique 6-digit number + 1 letter ID (no database lookup needed)"""
+    return await provider_id_allocator.allocate()
+
+def evaluate_professions(professions: List[str], has_trade_license: bool, has_health_permit: bool):
+    """Validate professions against the rule table; .error is the 400 detail, .status the per-profession status"""
+    rules = profession_rules.current()
+    return rules.evaluate(professions, rules.provided(trade_license=has_trade_license, health_permit=has_health_permit))
+
+async def issue_id_card(provider_id: str, mobile: str, professions: List[str]) -> Tuple[str, str]:
+    """Render QR + ID card; returns (qr_code base64, stored ID card content ID)"""
+    qr_png, id_card_png = await render_engine.render(provider_id, mobile, professions)
+    qr_code = base64.b64encode(qr_png).decode()
+    id_card = await asyncio.to_thread(doc_store.store_bytes, id_card_png)
+    return qr_code, id_card
+
+def build_json_provider(payload: ProviderRegistration, provider_id: str, qr_code: str, id_card: str) -> Provider:
+    """Provider for a JSON registration (documents are stored as the given strings)"""
+    # --- Build document references (JSON route stores raw base64 or provided string) ---
+    documents: Dict[str, Any] = {}
+    if payload.trade_license:
+        documents["trade_license"] = payload.trade_license
+    if payload.health_permit:
+        documents["health_permit"] = payload.health_permit
+    if payload.certificates:
+        documents["certificates"] = payload.certificates
+    documents["work_sample"] = payload.work_sample
+    documents["aadhaar_card"] = payload.aadhaar_card
+    documents["pan_card"] = payload.pan_card
+    documents["face_photo"] = payload.face_photo
+
+    # --- Determine professional status ---
+    has_trade_license = bool(payload.trade_license)
+    has_health_permit = bool(payload.health_permit)
+    professional_status = evaluate_professions(payload.professions, has_trade_license, has_health_permit).status
+
+    return Provider(
+        provider_id=provider_id,
+        email=payload.email,
+        mobile_number=payload.mobile_number,
+        professions=payload.professions,
+        has_trade_license=has_trade_license,
+        has_health_permit=has_health_permit,
+        has_certificates=bool(payload.certificates),
+        professional_status=professional_status,
+        documents=documents,
+        is_verified=True,
+        verification_date=datetime.now(timezone.utc),
+        qr_code=qr_code,
+        id_card_path=id_card,
+    )
+
+def profile_row(provider_id: str, email: Optional[str]) -> Dict[str, Any]:
+    profile_data = {"id": provider_id, "role": "provider"}
+    if email:
+        profile_data["full_name"] = email
+    return profile_data
+
+CONFLICT_DETAILS = {
+    "mobile_number": "Provider with this mobile number already exists",
+    "provider_id": "Provider with this ID already exists",
+}
+
+PROVIDER_ID_ATTEMPTS = 3
+
+def id_card_entries(provider: Provider) -> List[Tuple[str, int, str, Optional[str]]]:
+    return [("id_card", 0, blob_key(provider.id_card_path), f"{provider.provider_id}.png")]
+
+async def reissue_provider_id(provider: Provider, entries):
+    """Fresh ID and ID card for a registration whose allocated ID is already taken"""
+    provider_id = await generate_provider_id()
+    qr_code, id_card = await issue_id_card(provider_id, provider.mobile_number, provider.professions)
+    await doc_store.aunref([blob_key(provider.id_card_path)])
+    provider = provider.model_copy(update={"provider_id": provider_id, "qr_code": qr_code, "id_card_path": id_card})
+    return provider, [e for e in entries if e[0] != "id_card"] + id_card_entries(provider)
+
+async def drop_refs(entries):
+    """Release the blob references a failed registration took (also while it is being cancelled)"""
+    await asyncio.shield(doc_store.aunref([sha for _, _, sha, _ in entries]))
+
+async def insert_registration(provider: Provider, email: Optional[str], entries, allocated: bool):
+    """Insert profile + provider in one round trip; returns (row, provider, entries).
+
+    An allocated ID that collides with an existing row is replaced and the
+    insert retried. When the database rejects the row, or the call fails
+    before it is sent, the blob references in ``entries`` are dropped. If the
+    outcome is unknown (timeout, lost connection or cancellation while the
+    insert is in flight) the row may exist, so they are kept.
+    """
+    attempt = 1
+    in_flight = False
+    try:
+        while True:
+            try:
+                in_flight = True
+                row = await providers_repo.register(provider.dict(), profile_row(provider.provider_id, email))
+                return row, provider, entries
+            except ProviderConflict as ex:
+                in_flight = False
+                if not (allocated and ex.field == "provider_id" and attempt < PROVIDER_ID_ATTEMPTS):
+                    raise
+            logger.warning(f"Allocated provider ID {provider.provider_id} already exists; allocating another")
+            provider, entries = await reissue_provider_id(provider, entries)
+            attempt += 1
+    except (ProviderConflict, APIError):
+        await drop_refs(entries)
+        raise
+    except BaseException:
+        if not in_flight:
+            await drop_refs(entries)
+        raise
+
+async def commit_registration(provider: Provider, email: Optional[str], entries, allocated: bool) -> Response:
+    """Insert the registration and index its documents; returns the inserted row.
+
+    Documents are indexed under the provider only after the row is committed;
+    on failure only the blob references this request took are dropped.
+    """
+    try:
+        row, provider, entries = await insert_registration(provider, email, entries, allocated)
+    except ProviderConflict as ex:
+        raise HTTPException(status_code=400, detail=CONFLICT_DETAILS[ex.field])
+    await doc_store.aattach(provider.provider_id, entries)
+    return Response(fastjson.dumps(provider_payload(row)), media_type="application/json")
 
 # Routes
+root_response = PrecomputedJSON(lambda: {"message": "Service Provider Registration API"}, "public, max-age=3600")
+
 @api_router.get("/")
-async def root():
-    return {"message": "Service Provider Registration API"}
+async def root(request: Request):
+    return root_response.response(request)
 
 class MobileOtpRequest(BaseModel):
     mobile_number: str
@@ -215,32 +333,12 @@ def generate_otp_code() -> str:
     return ''.join(random.choices(string.digits, k=6))
 
 async def store_otp(target: str, kind: str, code: str, ttl_seconds: int = 300):
-    expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)
-    data = {
-        "target": target,
-        "type": kind,
-        "code": str(code),
-        "expires_at": expires_at.isoformat(),
-        "attempts": 0,
-    }
-    # Upsert by composite unique key (target, type)
-    supabase.table("otps").upsert(data, on_conflict=("target,type")).execute()
+    # Replaces any previous code for (target, kind) and resets its attempts
+    await otp_store.put(target, kind, code, ttl_seconds)
 
 async def verify_otp(target: str, kind: str, code: str) -> bool:
-    res = supabase.table("otps").select("code,expires_at,attempts").eq("target", target).eq("type", kind).limit(1).maybe_single().execute()
-    rec = (res.data if hasattr(res, 'data') else res).get('data') if hasattr(res, 'data') else res
-    if not rec:
-        return False
-    expires_at = rec.get("expires_at")
-    if expires_at and datetime.now(timezone.utc) > datetime.fromisoformat(expires_at):
-        return False
-    if str(rec.get("code")) != str(code):
-        # increment attempts
-        supabase.table("otps").update({"attempts": (rec.get("attempts") or 0) + 1}).eq("target", target).eq("type", kind).execute()
-        return False
-    # delete on success
-    supabase.table("otps").delete().eq("target", target).eq("type", kind).execute()
-    return True
+    # Atomic: a wrong code counts an attempt, the right one is consumed
+    return await otp_store.check_and_consume(target, kind, code)
 
 ## Removed email SMTP sender (email verification handled by Supabase)
 
@@ -256,62 +354,37 @@ async def send_mobile_otp(payload: MobileOtpRequest):
         raise HTTPException(status_code=400, detail="Invalid mobile number. Use 10 digits or E.164 format like +15551234567")
 
     e164 = format_e164(payload.mobile_number)
+    await rate_limits.enforce("otp_send", "mobile", payload.mobile_number)
     code = generate_otp_code()
     await store_otp(payload.mobile_number, "mobile", code)
 
-    # Try sending via n8n webhook if configured
-    sent_via = "logged"
-    webhook_url = os.environ.get("N8N_OTP_WEBHOOK_URL")
-    if webhook_url:
-        try:
-            resp = requests.post(
-                webhook_url,
-                json={
-                    "mobile_number": payload.mobile_number,
-                    "e164": e164,
-                    "otp": code,
-                },
-                timeout=10,
-            )
-            if 200 <= resp.status_code < 300:
-                sent_via = "n8n"
-            else:
-                logger.warning(f"n8n webhook responded with {resp.status_code}: {resp.text}")
-        except Exception as ex:
-            logger.warning(f"n8n webhook send failed: {ex}")
-
-    # Fallback to AWS SNS if not sent via n8n
-    if sent_via == "logged":
-        try:
-            region = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
-            if region:
-                sns = boto3.client("sns", region_name=region)
-                sms_type = os.environ.get("SNS_SMS_TYPE", "Transactional")
-                sender_id = os.environ.get("SNS_SENDER_ID")
-                attrs = {
-                    'AWS.SNS.SMS.SMSType': {'DataType': 'String', 'StringValue': sms_type},
-                }
-                if sender_id:
-                    attrs['AWS.SNS.SMS.SenderID'] = {'DataType': 'String', 'StringValue': sender_id[:11]}
-                sns.publish(
-                    PhoneNumber=e164,
-                    Message=f"Your OTP code is {code}. It expires in 5 minutes.",
-                    MessageAttributes=attrs,
-                )
-                sent_via = "sns"
-            else:
-                logger.info("AWS_REGION not set, skipping SNS. Logging OTP.")
-        except Exception as ex:
-            logger.warning(f"SNS send failed: {ex}. Falling back to logging OTP.")
-
-    if sent_via == "logged":
-        logger.info(f"Mobile OTP for {e164}: {code}")
-    return {"sent": True, "delivery": sent_via}
+    # Delivery (n8n webhook, then AWS SNS, then log) happens in the background
+    try:
+        otp_delivery.enqueue(OtpDeliveryJob(payload.mobile_number, e164, code))
+    except DeliveryQueueFull:
+        raise HTTPException(status_code=503, detail="OTP service is busy, please retry shortly")
+    return {"sent": True, "delivery": "queued"}
+
+@api_router.get("/otp/metrics")
+async def otp_delivery_metrics():
+    """Delivery queue depth, per-channel latency and circuit breaker states"""
+    return otp_delivery.snapshot()
+
+@api_router.get("/email-verification/metrics")
+async def email_verification_metrics():
+    """Write-behind queue depth, de-duplication counters and flush latency"""
+    return email_verification.snapshot()
+
+@api_router.get("/cache/metrics")
+async def provider_cache_metrics():
+    """Provider cache size, hit ratio and eviction counters"""
+    return provider_cache.stats()
 
 @api_router.post("/otp/verify")
 async def verify_mobile_otp(payload: VerifyMobileOtpRequest):
     if not re.fullmatch(r"\d{6}", payload.otp):
         raise HTTPException(status_code=400, detail="Invalid OTP format")
+    await rate_limits.enforce("otp_verify", "mobile", payload.mobile_number)
     ok = await verify_otp(payload.mobile_number, "mobile", payload.otp)
     return {"verified": ok}
 
@@ -331,12 +404,10 @@ async def set_email_verified(payload: EmailVerifiedPersistRequest):
     else:
         raise HTTPException(status_code=400, detail="Provide either email or provider_id")
 
-    now = datetime.now(timezone.utc)
-    if "email" in query:
-        res = supabase.table("providers").update({"email_verified": True, "email_verified_at": now.isoformat(), "updated_at": now.isoformat()}).eq("email", query["email"]).execute()
-    else:
-        res = supabase.table("providers").update({"email_verified": True, "email_verified_at": now.isoformat(), "updated_at": now.isoformat()}).eq("provider_id", query["provider_id"]).execute()
-    updated = len(getattr(res, 'data', []) or [])
+    column, value = next(iter(query.items()))
+    rows = await email_verification.submit(column, value, datetime.now(timezone.utc).isoformat())
+    await invalidate_providers(rows)
+    updated = len(rows)
     if updated == 0:
         raise HTTPException(status_code=404, detail="Provider not found for given identifier")
     return {"updated": updated}
@@ -362,30 +433,18 @@ async def supabase_auth_webhook(payload: SupabaseUserPayload):
         # Nothing to mirror if not confirmed
         return {"updated": 0, "message": "email_confirmed_at not set"}
 
-    now = datetime.now(timezone.utc)
-    res = supabase.table("providers").update({
-        "email_verified": True,
-        "email_verified_at": confirmed_at,
-        "updated_at": now.isoformat(),
-    }).eq("email", email).execute()
-    updated = len(getattr(res, 'data', []) or [])
+    # Retried deliveries of an applied event are answered without a write
+    rows = await email_verification.submit("email", email, confirmed_at)
+    await invalidate_providers(rows)
+    updated = len(rows)
     return {"updated": updated}
 
 @api_router.get("/professions")
-async def get_professions():
+async def get_professions(request: Request):
     """Get all available professions with their requirements"""
-    return {
-        "professions": [
-            {
-                "id": key,
-                "name": key.replace('_', ' ').title(),
-                "requires_trade_license": value["requires_trade_license"],
-                "optional_trade_license": value["trade_license"] and not value["requires_trade_license"],
-                "optional_health_permit": value["health_permit"]
-            }
-            for key, value in PROFESSIONS.items()
-        ]
-    }
+    # Re-encoded only when the rule table is reloaded
+    table = profession_rules.current()
+    return professions_response.response(request, version=table)
 
 @api_router.post("/register", response_model=Provider)
 async def register_provider(
@@ -405,221 +464,439 @@ async def register_provider(
     - Accepts files via UploadFile for documents and images.
     - Keeps business logic (QR/ID generation, provider ID, status) intact.
     """
+    await rate_limits.enforce("register", "mobile", mobile_number)
 
-    # --- Validate professions ---
-    for profession in professions:
-        if profession not in PROFESSIONS:
-            raise HTTPException(status_code=400, detail=f"Invalid profession: {profession}")
-
-    # --- Check mandatory requirements ---
-    for profession in professions:
-        if profession == "locksmith" and not trade_license:
-            raise HTTPException(status_code=400, detail="Trade License is mandatory for Locksmiths")
-
-    # --- Check mobile number uniqueness ---
-    existing_provider = supabase.table("providers").select("provider_id").eq("mobile_number", mobile_number).limit(1).maybe_single().execute()
-    if (getattr(existing_provider, 'data', None) or {}).get('provider_id'):
-        raise HTTPException(status_code=400, detail="Provider with this mobile number already exists")
+    # --- Validate professions and mandatory requirements ---
+    evaluation = evaluate_professions(professions, bool(trade_license), bool(health_permit))
+    if evaluation.error:
+        raise HTTPException(status_code=400, detail=evaluation.error)
 
     # --- Determine provider_id (user_id may be supplied by client) ---
-    provider_id = user_id or generate_provider_id()
-    if not user_id:
-        while True:
-            check = supabase.table("providers").select("provider_id").eq("provider_id", provider_id).limit(1).maybe_single().execute()
-            if not (getattr(check, 'data', None) or {}).get('provider_id'):
-                break
-            provider_id = generate_provider_id()
+    provider_id = user_id or await generate_provider_id()
 
-    # --- Ensure profile can satisfy provider fk (if profile table present) ---
+    # --- Save uploaded files (streamed concurrently, off the event loop) ---
     try:
-        profile_data = {"id": provider_id, "role": "provider"}
-        if email:
-            profile_data["full_name"] = email
-        supabase.table("profiles").upsert(profile_data).execute()
-    except Exception:
-        pass
-
-    # --- Save uploaded files ---
-    def save_file(file: UploadFile) -> str:
-        file_path = upload_dir / f"{uuid.uuid4()}_{file.filename}"
-        with open(file_path, "wb") as f:
-            f.write(file.file.read())
-        return str(file_path)
-
-    documents: Dict[str, Any] = {}
-    if trade_license:
-        documents["trade_license"] = save_file(trade_license)
-    if health_permit:
-        documents["health_permit"] = save_file(health_permit)
-    documents["work_sample"] = save_file(work_sample)
-    documents["aadhaar_card"] = save_file(aadhaar_card)
-    documents["pan_card"] = save_file(pan_card)
-    if face_photo:
-        documents["face_photo"] = save_file(face_photo)
-    if certificates:
-        documents["certificates"] = [save_file(cert) for cert in certificates]
+        stored = await ingest_documents({
+            "trade_license": trade_license,
+            "health_permit": health_permit,
+            "work_sample": work_sample,
+            "aadhaar_card": aadhaar_card,
+            "pan_card": pan_card,
+            "face_photo": face_photo,
+            "certificates": certificates,
+        }, doc_store)
+    except UploadTooLarge as ex:
+        raise HTTPException(status_code=413, detail=str(ex))
+    logger.info(f"Stored {total_size(stored)} bytes of documents for provider {provider_id}")
+    documents: Dict[str, Any] = document_ids(stored)
 
     # --- Determine professional status ---
-    professional_status: Dict[str, str] = {}
-    for profession in professions:
-        status = determine_professional_status(
-            profession,
-            bool(trade_license),
-            bool(health_permit),
+    professional_status = evaluation.status
+
+    # From here on the references are handed to commit_registration or dropped
+    entries = index_entries(stored)
+    try:
+        # --- Generate QR code and ID card ---
+        qr_code, id_card = await issue_id_card(provider_id, mobile_number, professions)
+        entries.append(("id_card", 0, blob_key(id_card), f"{provider_id}.png"))
+
+        # --- Create Provider object ---
+        provider = Provider(
+            provider_id=provider_id,
+            email=email,
+            mobile_number=mobile_number,
+            professions=professions,
+            has_trade_license=bool(trade_license),
+            has_health_permit=bool(health_permit),
+            has_certificates=bool(certificates),
+            professional_status=professional_status,
+            documents=documents,
+            is_verified=True,  # Auto-verify for MVP
+            verification_date=datetime.now(timezone.utc),
+            qr_code=qr_code,
+            id_card_path=id_card,
         )
-        professional_status[profession] = status
+    except BaseException:
+        await drop_refs(entries)
+        raise
 
-    # --- Generate QR code and ID card ---
-    qr_code = generate_qr_code(provider_id, mobile_number)
-    id_card = generate_id_card(provider_id, mobile_number, professions, qr_code)
+    # --- Save to Supabase (profile + provider in one transaction; unique
+    # constraints reject duplicate mobile numbers) ---
+    return await commit_registration(provider, email, entries, allocated=not user_id)
 
-    # --- Create Provider object ---
-    provider = Provider(
-        provider_id=provider_id,
-        email=email,
-        mobile_number=mobile_number,
-        professions=professions,
-        has_trade_license=bool(trade_license),
-        has_health_permit=bool(health_permit),
-        has_certificates=bool(certificates),
-        professional_status=professional_status,
-        documents=documents,
-        is_verified=True,  # Auto-verify for MVP
-        verification_date=datetime.now(timezone.utc),
-        qr_code=qr_code,
-        id_card_path=id_card,
-    )
-
-    # --- Save to Supabase ---
-    supabase.table("providers").insert(provider.dict()).execute()
+@api_router.get("/provider/{provider_id}", response_model=Provider)
+async def get_provider(provider_id: str, view: str = Query("full", pattern=VIEW_PATTERN)):
+    """Get provider details.
 
-    return provider
+    ``view=summary`` (ID, professions, status) or ``view=detail`` (no media)
+    select only those columns; media is available from /qr-code, /documents
+    and /id-card.
+    """
+    provider = await cached_provider(provider_id, view)
+    if not provider:
+        raise HTTPException(status_code=404, detail="Provider not found")
+    # Encoded directly; response_model only documents the shape
+    return Response(fastjson.dumps(provider_payload(provider, view)), media_type="application/json")
 
-@api_router.get("/provider/{provider_id}", response_model=Provider)
-async def get_provider(provider_id: str):
-    """Get provider details"""
-    res = supabase.table("providers").select("*").eq("provider_id", provider_id).limit(1).maybe_single().execute()
-    provider = getattr(res, 'data', None)
+@api_router.get("/provider/{provider_id}/qr-code")
+async def get_provider_qr_code(provider_id: str, request: Request):
+    """Provider QR code as image/png (supports If-None-Match and Range)"""
+    provider = await cached_provider(provider_id, "qr_code")
     if not provider:
         raise HTTPException(status_code=404, detail="Provider not found")
-    return Provider(**provider)
+    if not provider.get("qr_code"):
+        raise HTTPException(status_code=404, detail="QR code not found")
+    data = base64.b64decode(provider["qr_code"])
+    return await binary_response(request, f'"{hashlib.sha256(data).hexdigest()}"', "image/png", data=data)
+
+@api_router.get("/provider/{provider_id}/documents")
+async def get_provider_documents(provider_id: str):
+    """Provider document references (content IDs or legacy inline values)"""
+    provider = await cached_provider(provider_id, "documents")
+    if not provider:
+        raise HTTPException(status_code=404, detail="Provider not found")
+    return Response(fastjson.dumps({"documents": provider.get("documents") or {}}), media_type="application/json")
 
 @api_router.get("/provider/{provider_id}/id-card")
-async def download_id_card(provider_id: str):
-    """Download provider ID card"""
-    res = supabase.table("providers").select("id_card_path").eq("provider_id", provider_id).limit(1).maybe_single().execute()
-    provider = getattr(res, 'data', None)
+async def download_id_card(provider_id: str, request: Request):
+    """Download provider ID card as image/png (supports If-None-Match and Range)"""
+    provider = await cached_provider(provider_id, "id_card")
     if not provider:
         raise HTTPException(status_code=404, detail="Provider not found")
     
-    if not provider.get('id_card_path'):
+    ref = provider.get('id_card_path')
+    if not ref:
         raise HTTPException(status_code=404, detail="ID card not found")
     
-    # Return base64 encoded ID card
-    return {
-        "id_card": provider['id_card_path'],
-        "provider_id": provider_id,
-        "format": "base64_png"
-    }
+    filename = f"provider-id-{provider_id}.png"
+    if ref.startswith(CONTENT_ID_PREFIX):
+        path = doc_store.path_for(ref)
+        if not path:
+            raise HTTPException(status_code=404, detail="ID card not found")
+        return await binary_response(request, f'"{blob_key(ref)}"', "image/png", path=path, filename=filename)
+    
+    # Legacy rows store the base64 PNG inline
+    data = base64.b64decode(ref)
+    return await binary_response(request, f'"{hashlib.sha256(data).hexdigest()}"', "image/png", data=data, filename=filename)
 
 @api_router.patch("/provider/{provider_id}/wallet")
-async def update_wallet(provider_id: str, amount: float):
-    """Update provider wallet balance"""
-    # Read-modify-write (non-atomic). Prefer DB function/constraint in production.
-    res = supabase.table("providers").select("wallet_balance").eq("provider_id", provider_id).limit(1).maybe_single().execute()
-    current = (getattr(res, 'data', None) or {}).get('wallet_balance')
-    if current is None:
+async def update_wallet(
+    provider_id: str,
+    amount: str,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """Credit (or debit, if negative) the provider wallet.
+
+    Appends one ledger entry and moves the balance atomically. Retrying with
+    the same Idempotency-Key header returns the balance without re-applying.
+    """
+    try:
+        value = parse_amount(amount)
+    except WalletError as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+    try:
+        result = await wallet_writer.apply(provider_id, value, idempotency_key or str(uuid.uuid4()))
+    except WalletProviderNotFound:
         raise HTTPException(status_code=404, detail="Provider not found")
-    new_balance = float(current) + float(amount)
-    supabase.table("providers").update({"wallet_balance": new_balance, "updated_at": datetime.now(timezone.utc).isoformat()}).eq("provider_id", provider_id).execute()
-    
-    return {"message": "Wallet updated successfully"}
+    finally:
+        await provider_cache.invalidate(provider_id)
+    return {"message": "Wallet updated successfully", "wallet_balance": float(result.balance), "applied": result.applied}
 
 @api_router.post("/register/json", response_model=Provider)
 async def register_provider_json(payload: ProviderRegistration):
     """Register provider using JSON payload (e.g., test clients)"""
+    await rate_limits.enforce("register", "mobile", payload.mobile_number)
 
-    # --- Validate professions ---
-    for profession in payload.professions:
-        if profession not in PROFESSIONS:
-            raise HTTPException(status_code=400, detail=f"Invalid profession: {profession}")
-
-    # --- Mandatory checks ---
-    if "locksmith" in payload.professions and not payload.trade_license:
-        raise HTTPException(status_code=400, detail="Trade License is mandatory for Locksmiths")
-
-    # --- Check mobile number uniqueness ---
-    existing_provider = supabase.table("providers").select("provider_id").eq("mobile_number", payload.mobile_number).limit(1).maybe_single().execute()
-    if (getattr(existing_provider, 'data', None) or {}).get('provider_id'):
-        raise HTTPException(status_code=400, detail="Provider with this mobile number already exists")
+    # --- Validate professions and mandatory requirements ---
+    error = evaluate_professions(payload.professions, bool(payload.trade_license), bool(payload.health_permit)).error
+    if error:
+        raise HTTPException(status_code=400, detail=error)
 
     # --- Determine provider_id (user_id may be supplied in payload) ---
-    provider_id = payload.user_id or generate_provider_id()
-    if not payload.user_id:
-        while True:
-            check = supabase.table("providers").select("provider_id").eq("provider_id", provider_id).limit(1).maybe_single().execute()
-            if not (getattr(check, 'data', None) or {}).get('provider_id'):
-                break
-            provider_id = generate_provider_id()
+    provider_id = payload.user_id or await generate_provider_id()
 
-    # --- Ensure FK target profile exists (if profile table exists) ---
+    # --- Generate QR code and ID card ---
+    qr_code, id_card = await issue_id_card(provider_id, payload.mobile_number, payload.professions)
+    entries = [("id_card", 0, blob_key(id_card), f"{provider_id}.png")]
     try:
-        profile_data = {"id": provider_id, "role": "provider"}
-        if payload.email:
-            profile_data["full_name"] = payload.email
-        supabase.table("profiles").upsert(profile_data).execute()
-    except Exception:
-        pass
+        provider = build_json_provider(payload, provider_id, qr_code, id_card)
+    except BaseException:
+        await drop_refs(entries)
+        raise
+    return await commit_registration(provider, payload.email, entries, allocated=not payload.user_id)
+
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", "200"))
+BULK_LIST_FIELDS = {"professions", "certificates"}
+
+def _bulk_records(body: BinaryIO, is_csv: bool) -> Iterator[Tuple[int, Any]]:
+    """Yield (row number, dict or error string) from a CSV or NDJSON body"""
+    header: Optional[List[str]] = None
+    row_no = 0
+    for raw in body:
+        line = raw.decode("utf-8-sig").rstrip("\r\n")
+        if not line.strip():
+            continue
+        if is_csv and header is None:
+            header = [h.strip() for h in next(csv.reader([line]))]
+            continue
+        row_no += 1
+        try:
+            if is_csv:
+                values = next(csv.reader([line]))
+                record: Dict[str, Any] = {}
+                for key, value in zip(header, values):
+                    value = value.strip()
+                    if not value:
+                        continue
+                    record[key] = [v.strip() for v in re.split(r"[;|]", value) if v.strip()] if key in BULK_LIST_FIELDS else value
+            else:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+            yield row_no, record
+        except (csv.Error, ValueError) as ex:
+            yield row_no, f"Unparseable row: {ex}"
+
+async def _register_bulk_chunk(chunk: List[Tuple[int, Any]], seen_mobiles: set) -> List[Dict[str, Any]]:
+    """Validate, allocate, render and write one chunk; returns per-row results"""
+    results: Dict[int, Dict[str, Any]] = {}
+    parsed: List[Tuple[int, ProviderRegistration]] = []
+    for row_no, record in chunk:
+        if isinstance(record, str):
+            results[row_no] = {"row": row_no, "status": "error", "detail": record}
+            continue
+        if not isinstance(record, dict):
+            results[row_no] = {"row": row_no, "status": "error", "detail": "Row must be an object"}
+            continue
+        try:
+            parsed.append((row_no, ProviderRegistration(**record)))
+        except ValidationError as ex:
+            results[row_no] = {"row": row_no, "status": "error", "detail": ex.errors(include_url=False, include_context=False)}
+        except TypeError as ex:
+            results[row_no] = {"row": row_no, "status": "error", "detail": f"Invalid row: {ex}"}
+
+    # --- Profession rules for the whole chunk in one pass ---
+    rules = profession_rules.current()
+    evaluations = rules.evaluate_many(
+        (p.professions, rules.provided(trade_license=bool(p.trade_license), health_permit=bool(p.health_permit)))
+        for _, p in parsed
+    )
+    valid: List[Tuple[int, ProviderRegistration]] = []
+    for (row_no, payload), evaluation in zip(parsed, evaluations):
+        error = evaluation.error
+        if not error and payload.mobile_number in seen_mobiles:
+            error = "Duplicate mobile number in batch"
+        if error:
+            results[row_no] = {"row": row_no, "status": "error", "detail": error}
+            continue
+        seen_mobiles.add(payload.mobile_number)
+        valid.append((row_no, payload))
+
+    # --- Mobile uniqueness: one query for the whole chunk ---
+    existing = set(await providers_repo.existing_mobiles([p.mobile_number for _, p in valid]))
+    accepted = []
+    for row_no, payload in valid:
+        if payload.mobile_number in existing:
+            results[row_no] = {"row": row_no, "status": "error", "detail": "Provider with this mobile number already exists"}
+        else:
+            accepted.append((row_no, payload))
+
+    # --- Allocate IDs in bulk, render cards in parallel ---
+    fresh_ids = iter(await provider_id_allocator.allocate_many(sum(1 for _, p in accepted if not p.user_id)))
+    provider_ids = [p.user_id or next(fresh_ids) for _, p in accepted]
+    assets = await asyncio.gather(*(
+        issue_id_card(pid, p.mobile_number, p.professions) for pid, (_, p) in zip(provider_ids, accepted)
+    ), return_exceptions=True)
+    rendered: List[Tuple[int, Provider, bool]] = []
+    for pid, (row_no, p), asset in zip(provider_ids, accepted, assets):
+        if isinstance(asset, BaseException):
+            logger.warning(f"ID card render failed for bulk row {row_no}: {asset}")
+            results[row_no] = {"row": row_no, "status": "error", "detail": "ID card could not be generated"}
+        else:
+            rendered.append((row_no, build_json_provider(p, pid, *asset), not p.user_id))
+
+    # --- Batched writes (fall back to per-row inserts to isolate failures) ---
+    try:
+        await providers_repo.upsert_profiles([profile_row(pr.provider_id, pr.email) for _, pr, _ in rendered])
+    except Exception as ex:
+        # Best-effort like single registration; the per-row fallback retries them
+        logger.warning(f"Bulk profile upsert failed for {len(rendered)} providers: {ex}")
+    # Rejected rows are dropped; rows whose outcome is unknown (e.g. a timeout
+    # after the server committed) keep their references and are not retried
+    failed: Dict[int, str] = {}
+    unknown: Dict[int, str] = {}
+    try:
+        await providers_repo.insert_many([provider.dict() for _, provider, _ in rendered])
+    except APIError:
+        for i, (row_no, provider, allocated) in enumerate(rendered):
+            try:
+                _, provider, _ = await insert_registration(provider, provider.email, id_card_entries(provider), allocated)
+                rendered[i] = (row_no, provider, allocated)
+            except ProviderConflict as ex:
+                failed[row_no] = CONFLICT_DETAILS[ex.field]
+            except APIError as ex:
+                failed[row_no] = ex.message or str(ex)
+            except Exception as ex:
+                unknown[row_no] = f"Outcome unknown, check provider {provider.provider_id} before retrying: {ex}"
+    except Exception as ex:
+        logger.warning(f"Bulk insert of {len(rendered)} providers has an unknown outcome: {ex}")
+        for row_no, provider, _ in rendered:
+            unknown[row_no] = f"Outcome unknown, check provider {provider.provider_id} before retrying: {ex}"
+
+    # --- Index ID cards of committed (or possibly committed) rows; rejected rows dropped theirs ---
+    await asyncio.to_thread(doc_store.attach_many, {
+        pr.provider_id: id_card_entries(pr) for row_no, pr, _ in rendered if row_no not in failed
+    })
+
+    for row_no, provider, _ in rendered:
+        if row_no in failed:
+            results[row_no] = {"row": row_no, "status": "error", "detail": failed[row_no]}
+        elif row_no in unknown:
+            results[row_no] = {"row": row_no, "status": "error", "detail": unknown[row_no]}
+        else:
+            results[row_no] = {"row": row_no, "status": "created", "provider_id": provider.provider_id}
+    return [results[row_no] for row_no, _ in chunk]
+
+@api_router.post("/register/bulk")
+async def register_providers_bulk(request: Request):
+    """Bulk onboarding from CSV (Content-Type: text/csv) or NDJSON.
+
+    Rows use the /register/json fields; in CSV, professions and certificates
+    are separated by ';' or '|'. Rows are processed in chunks of
+    BULK_CHUNK_SIZE and a per-row NDJSON report is streamed back, ending
+    with a summary line.
+    """
+    # Spool the body first: the streamed report cannot read the request concurrently
+    body = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    async for data in request.stream():
+        body.write(data)
+    body.seek(0)
+    is_csv = "csv" in request.headers.get("content-type", "")
+
+    async def report():
+        seen_mobiles: set = set()
+        created = failed = 0
+        chunk: List[Tuple[int, Any]] = []
+
+        async def flush():
+            nonlocal created, failed
+            lines = []
+            for result in await _register_bulk_chunk(chunk, seen_mobiles):
+                if result["status"] == "created":
+                    created += 1
+                else:
+                    failed += 1
+                lines.append(json.dumps(result, default=str) + "\n")
+            chunk.clear()
+            return "".join(lines)
 
-    # --- Build document references (JSON route stores raw base64 or provided string) ---
-    documents: Dict[str, Any] = {}
-    if payload.trade_license:
-        documents["trade_license"] = payload.trade_license
-    if payload.health_permit:
-        documents["health_permit"] = payload.health_permit
-    if payload.certificates:
-        documents["certificates"] = payload.certificates
-    documents["work_sample"] = payload.work_sample
-    documents["aadhaar_card"] = payload.aadhaar_card
-    documents["pan_card"] = payload.pan_card
-    documents["face_photo"] = payload.face_photo
+        try:
+            for row in _bulk_records(body, is_csv):
+                chunk.append(row)
+                if len(chunk) >= BULK_CHUNK_SIZE:
+                    yield await flush()
+            if chunk:
+                yield await flush()
+            yield json.dumps({"summary": {"created": created, "failed": failed}}) + "\n"
+        finally:
+            body.close()
+
+    return StreamingResponse(report(), media_type="application/x-ndjson")
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    raw = json.dumps([str(row["created_at"]), str(row["id"])]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), str(uuid.UUID(str(row_id)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def provider_columns(fields: Optional[str]) -> Optional[List[str]]:
+    """Validate a ``fields=`` projection; the keyset columns are always included."""
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in Provider.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys(requested + ["created_at", "id"]))
+
+# Provider fields with their defaults, for shaping trusted rows without pydantic
+PROVIDER_DEFAULTS: Dict[str, Any] = {
+    name: None if field.is_required() or field.default_factory else field.default
+    for name, field in Provider.model_fields.items()
+}
+VALIDATE_PROVIDER_ROWS = os.environ.get("PROVIDER_VALIDATE_ROWS", "false").lower() == "true"
 
-    # --- Determine professional status ---
-    professional_status: Dict[str, str] = {}
-    has_trade_license = bool(payload.trade_license)
-    has_health_permit = bool(payload.health_permit)
+VIEW_MODELS = {"summary": ProviderSummary, "detail": ProviderDetail, "full": Provider}
 
-    for profession in payload.professions:
-        professional_status[profession] = determine_professional_status(profession, has_trade_license, has_health_permit)
+def provider_payload(row: Dict[str, Any], view: str = "full") -> Dict[str, Any]:
+    """Shape a providers row like the view's model without building the model.
 
-    # --- Generate QR code and ID card ---
-    qr_code = generate_qr_code(provider_id, payload.mobile_number)
-    id_card = generate_id_card(provider_id, payload.mobile_number, payload.professions, qr_code)
+    Rows come from our own table, so they are trusted by default; set
+    PROVIDER_VALIDATE_ROWS=true to validate each row once instead.
+    """
+    if VALIDATE_PROVIDER_ROWS:
+        return VIEW_MODELS[view].model_validate(row).model_dump(mode="json")
+    return {name: row.get(name, PROVIDER_DEFAULTS[name]) for name in PROVIDER_VIEWS[view]}
 
-    provider = Provider(
-        provider_id=provider_id,
-        email=payload.email,
-        mobile_number=payload.mobile_number,
-        professions=payload.professions,
-        has_trade_license=has_trade_license,
-        has_health_permit=has_health_permit,
-        has_certificates=bool(payload.certificates),
-        professional_status=professional_status,
-        documents=documents,
-        is_verified=True,
-        verification_date=datetime.now(timezone.utc),
-        qr_code=qr_code,
-        id_card_path=id_card,
-    )
+def provider_item(row: Dict[str, Any], columns: Optional[List[str]]) -> Dict[str, Any]:
+    if columns is None:
+        return provider_payload(row)
+    return {key: row.get(key) for key in columns}
 
-    supabase.table("providers").insert(provider.dict()).execute()
-    return provider
 @api_router.get("/providers", response_model=List[Provider])
-async def list_providers():
-    """List all providers (for admin)"""
-    res = supabase.table("providers").select("*").limit(1000).execute()
-    rows = getattr(res, 'data', []) or []
-    return [Provider(**provider) for provider in rows]
+async def list_providers(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    view: Optional[str] = Query(None, pattern=VIEW_PATTERN),
+    format: Optional[str] = Query(None, pattern="^(json|ndjson)$"),
+):
+    """List providers (for admin), keyset-paginated on (created_at, id).
+
+    - ``fields=a,b`` selects only those columns in PostgREST; ``view=summary``
+      or ``view=detail`` selects a read tier's columns.
+    - The next page cursor is returned in ``X-Next-Cursor`` and a ``Link`` header.
+    - ``format=ndjson`` (or ``Accept: application/x-ndjson``) streams every row
+      from ``cursor`` onwards, fetching ``limit`` rows per round trip.
+    """
+    columns = provider_columns(fields or (",".join(PROVIDER_VIEWS[view]) if view else None))
+    select = ",".join(columns) if columns else "*"
+    after = decode_cursor(cursor) if cursor else None
+
+    if format == "ndjson" or (format is None and "application/x-ndjson" in request.headers.get("accept", "")):
+        async def stream_rows():
+            position = after
+            while True:
+                rows = await providers_repo.page(select, position, limit)
+                for row in rows:
+                    yield fastjson.dumps(provider_item(row, columns)) + b"\n"
+                if len(rows) < limit:
+                    return
+                position = (str(rows[-1]["created_at"]), str(rows[-1]["id"]))
+        return StreamingResponse(stream_rows(), media_type="application/x-ndjson")
+
+    rows = await providers_repo.page(select, after, limit)
+    headers: Dict[str, str] = {}
+    if len(rows) == limit:
+        next_cursor = encode_cursor(rows[-1])
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return Response(fastjson.dumps([provider_item(row, columns) for row in rows]), media_type="application/json", headers=headers)
+
+@app.exception_handler(DatabaseTimeout)
+async def database_timeout_handler(request: Request, exc: DatabaseTimeout):
+    logger.warning(f"Supabase call timed out on {request.url.path}: {exc}")
+    return JSONResponse(status_code=504, content={"detail": "Database request timed out"})
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_handler(request: Request, exc: RateLimitExceeded):
+    return JSONResponse(status_code=429, content={"detail": "Too many requests"}, headers=exc.headers)
 
 # Favicon endpoint to suppress 404 errors
 @app.get("/favicon.ico", include_in_schema=False)
@@ -629,6 +906,15 @@ async def favicon():
 # Include the router in the main app
 app.include_router(api_router)
 
+# Per-IP limits are checked before the request body is read; added before
+# CORS so CORSMiddleware wraps it and 429 responses carry CORS headers
+app.add_middleware(
+    RateLimitMiddleware,
+    limits=rate_limits,
+    paths=RATE_LIMITED_PATHS,
+    trust_proxy=os.environ.get("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true",
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -644,7 +930,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_background_workers():
+    otp_delivery.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    # No explicit shutdown needed for Supabase client
-    pass
+    # Deliver queued OTPs before the HTTP client goes away
+    await otp_delivery.aclose()
+    # Flush coalesced wallet credits
+    await wallet_writer.aclose()
+    # Apply queued email verifications
+    await email_verification.aclose()
+    # Release pooled PostgREST connections
+    await db.aclose()
+    doc_store.close()
+    render_engine.shutdown()
+    await otp_store.aclose()
+    await rate_limits.aclose()
+    await provider_cache.aclose()
@@ -0,0 +1,151 @@
+"""Wallet balance changes through the append-only ``wallet_ledger``.
+
+Every change is one ledger entry with an idempotency key, applied together
+with the balance update by the ``apply_wallet_entries`` RPC in a single
+transaction, so concurrent updates never lose money and retries are no-ops.
+With coalescing enabled, credits to the same provider that arrive within
+one flush interval share a single RPC.
+"""
+import asyncio
+import os
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+
+from postgrest.exceptions import APIError
+
+CENT = Decimal("0.01")
+# Matches NUMERIC(14, 2) on providers.wallet_balance / wallet_ledger.amount
+MAX_AMOUNT = Decimal("999999999999.99")
+
+
+class WalletError(Exception):
+    """Invalid wallet amount."""
+
+
+class WalletProviderNotFound(Exception):
+    """The RPC found no provider with that ID."""
+
+
+def parse_amount(raw: str) -> Decimal:
+    """Exact amount with at most two decimal places."""
+    try:
+        amount = Decimal(raw)
+    except InvalidOperation as ex:
+        raise WalletError("Amount must be a decimal number") from ex
+    if not amount.is_finite():
+        raise WalletError("Amount must be a decimal number")
+    # Range first: quantize raises InvalidOperation on huge exponents (e.g. 1e100)
+    if amount == 0 or abs(amount) > MAX_AMOUNT:
+        raise WalletError("Amount must be non-zero and within wallet limits")
+    if amount.quantize(CENT) != amount:
+        raise WalletError("Amount must have at most two decimal places")
+    return amount.quantize(CENT)
+
+
+class WalletResult:
+    __slots__ = ("balance", "applied")
+
+    def __init__(self, balance: Decimal, applied: bool):
+        self.balance = balance
+        self.applied = applied
+
+
+class WalletLedger:
+    """Applies ledger entries through the ``apply_wallet_entries`` RPC."""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def apply_many(self, provider_id: str, entries: List[Tuple[Decimal, str]]) -> Tuple[Decimal, List[str]]:
+        """Apply (amount, idempotency_key) entries atomically; returns (balance, applied keys)."""
+        payload = [{"amount": str(amount), "idempotency_key": key} for amount, key in entries]
+        try:
+            res = await self.db.execute(
+                self.db.rpc("apply_wallet_entries", {"p_provider_id": provider_id, "p_entries": payload})
+            )
+        except APIError as ex:
+            if ex.code == "P0002":
+                raise WalletProviderNotFound(provider_id) from ex
+            raise
+        return Decimal(res.data["balance"]), res.data["applied"]
+
+    async def apply(self, provider_id: str, amount: Decimal, idempotency_key: str) -> WalletResult:
+        balance, applied = await self.apply_many(provider_id, [(amount, idempotency_key)])
+        return WalletResult(balance, idempotency_key in applied)
+
+    async def aclose(self):
+        pass
+
+
+class CreditCoalescer:
+    """Merges credits per provider into one RPC per ``interval`` seconds.
+
+    Debits bypass the batch so an overdraft check (if added to the RPC)
+    always sees the latest balance.
+    """
+
+    def __init__(self, ledger: WalletLedger, interval: float):
+        self.ledger = ledger
+        self.interval = interval
+        self._pending: Dict[str, List[Tuple[Decimal, str, asyncio.Future]]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def apply(self, provider_id: str, amount: Decimal, idempotency_key: str) -> WalletResult:
+        if amount < 0:
+            return await self.ledger.apply(provider_id, amount, idempotency_key)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(provider_id, []).append((amount, idempotency_key, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    async def flush(self):
+        batch, self._pending = self._pending, {}
+        await asyncio.gather(*(self._flush_provider(pid, items) for pid, items in batch.items()))
+
+    async def _flush_provider(self, provider_id: str, items: List[Tuple[Decimal, str, asyncio.Future]]):
+        try:
+            balance, applied = await self.ledger.apply_many(provider_id, [(amount, key) for amount, key, _ in items])
+        except APIError as ex:
+            if len(items) == 1:
+                if not items[0][2].done():
+                    items[0][2].set_exception(ex)
+                return
+            # The RPC rolled the whole batch back (e.g. the merged credits
+            # overflow NUMERIC(14,2)); apply one by one so only the bad entry fails
+            for amount, key, future in items:
+                try:
+                    result = await self.ledger.apply(provider_id, amount, key)
+                except Exception as item_ex:
+                    if not future.done():
+                        future.set_exception(item_ex)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            return
+        except Exception as ex:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(ex)
+            return
+        applied_keys = set(applied)
+        for _, key, future in items:
+            if not future.done():
+                future.set_result(WalletResult(balance, key in applied_keys))
+                # A key repeated within one batch is only applied once
+                applied_keys.discard(key)
+
+    async def aclose(self):
+        if self._flusher is not None:
+            await self._flusher
+        await self.flush()
+
+
+def wallet_from_env(ledger: WalletLedger):
+    """The ledger itself, or a CreditCoalescer over it when WALLET_COALESCE_MS > 0."""
+    interval_ms = float(os.environ.get("WALLET_COALESCE_MS", "0"))
+    return CreditCoalescer(ledger, interval_ms / 1000) if interval_ms > 0 else ledger
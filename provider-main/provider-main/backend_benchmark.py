@@ -0,0 +1,384 @@
+import asyncio
+import json
+import logging
+import random
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("SUPABASE_URL", "http://supabase.bench")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "bench-key")
+os.environ.setdefault("PROVIDER_ID_KEY", "bench-provider-id-key")
+
+import fastjson  # noqa: E402
+import server  # noqa: E402
+from db import SupabaseDB  # noqa: E402
+from render import RenderEngine, render_provider_assets  # noqa: E402
+from profession_rules import RuleTable  # noqa: E402
+from provider_cache import ProviderCache  # noqa: E402
+from provider_ids import FileBlockSource, ProviderIdAllocator  # noqa: E402
+from email_verification import EmailVerificationQueue  # noqa: E402
+from wallet import CreditCoalescer  # noqa: E402
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+SAMPLE_PROVIDER = {
+    "id": "00000000-0000-0000-0000-000000000000",
+    "provider_id": "123456A",
+    "email": None,
+    "mobile_number": "9876543210",
+    "professions": ["electrician"],
+    "professional_status": {"electrician": "Professional"},
+    "documents": {},
+    "wallet_balance": 0.0,
+    "created_at": "2025-01-01T00:00:00+00:00",
+    "updated_at": "2025-01-01T00:00:00+00:00",
+}
+
+
+def _allocate_ids(state_file, count, block_size, queue):
+    async def run():
+        allocator = ProviderIdAllocator(FileBlockSource(Path(state_file)), b"bench-key", block_size)
+        return [await allocator.allocate() for _ in range(count)]
+    queue.put(asyncio.run(run()))
+
+
+class ServiceProviderBenchmark:
+    """In-process benchmarks against a simulated PostgREST with fixed latency."""
+
+    def __init__(self, latency_ms=20.0):
+        self.latency = latency_ms / 1000.0
+        self.results = []
+
+    def fake_postgrest(self):
+        async def handler(request: httpx.Request) -> httpx.Response:
+            await asyncio.sleep(self.latency)
+            return httpx.Response(200, json=[SAMPLE_PROVIDER])
+        return httpx.MockTransport(handler)
+
+    def use_fake_db(self):
+        fake = SupabaseDB("http://supabase.bench", "bench-key", transport=self.fake_postgrest())
+        server.db = fake
+        server.providers_repo.db = fake
+        server.wallet_ledger.db = fake
+        server.email_verification.db = fake
+        return fake
+
+    def fake_wallet_rpc(self, state):
+        """apply_wallet_entries semantics: one ledger row per key, balance moved atomically"""
+        async def handler(request: httpx.Request) -> httpx.Response:
+            await asyncio.sleep(self.latency)
+            state["rpc_calls"] += 1
+            body = json.loads(request.content)
+            applied = []
+            for entry in body["p_entries"]:
+                if entry["idempotency_key"] not in state["ledger"]:
+                    state["ledger"][entry["idempotency_key"]] = Decimal(entry["amount"])
+                    state["balance"] += Decimal(entry["amount"])
+                    applied.append(entry["idempotency_key"])
+            return httpx.Response(200, json={"balance": str(state["balance"]), "applied": applied, "duplicates": []})
+        return httpx.MockTransport(handler)
+
+    def fake_verify_rpc(self, state):
+        """mark_emails_verified semantics: one provider per email, already-verified rows not rewritten"""
+        async def handler(request: httpx.Request) -> httpx.Response:
+            await asyncio.sleep(self.latency)
+            state["rpc_calls"] += 1
+            rows = []
+            for entry in json.loads(request.content)["p_entries"]:
+                email = entry["email"]
+                changed = email not in state["verified"]
+                state["verified"].add(email)
+                state["writes"] += changed
+                rows.append({"key": entry["key"], "id": email, "provider_id": email, "changed": changed})
+            return httpx.Response(200, json=rows)
+        return httpx.MockTransport(handler)
+
+    def report(self, name, rows):
+        print(f"\n{name}")
+        print("-" * 60)
+        for row in rows:
+            print("  " + "  ".join(f"{k}={v}" for k, v in row.items()))
+        self.results.append({"benchmark": name, "rows": rows})
+
+    async def bench_get_provider_concurrency(self, levels=(1, 4, 16, 64), requests_per_level=256):
+        """Concurrent GET /api/provider/{id} throughput vs in-flight requests (cache disabled)"""
+        fake = self.use_fake_db()
+        original_cache, server.provider_cache = server.provider_cache, ProviderCache(max_bytes=0)
+        rows = []
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for level in levels:
+                sem = asyncio.Semaphore(level)
+
+                async def one():
+                    async with sem:
+                        r = await client.get(f"/api/provider/{SAMPLE_PROVIDER['provider_id']}")
+                        assert r.status_code == 200, r.text
+
+                start = time.perf_counter()
+                await asyncio.gather(*(one() for _ in range(requests_per_level)))
+                elapsed = time.perf_counter() - start
+                rows.append({
+                    "in_flight": level,
+                    "req/s": f"{requests_per_level / elapsed:8.1f}",
+                    "ideal_req/s": f"{level / self.latency:8.1f}",
+                })
+        await fake.aclose()
+        server.provider_cache = original_cache
+        self.report(f"GET /api/provider/{{id}} (simulated PostgREST latency {self.latency * 1000:.0f} ms)", rows)
+
+    async def bench_provider_cache(self, providers=200, requests=5000, in_flight=64):
+        """GET /api/provider/{id} with the provider cache: hit ratio and req/s vs uncached"""
+        calls = {"n": 0}
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            calls["n"] += 1
+            await asyncio.sleep(self.latency)
+            pid = request.url.params.get("provider_id", "eq.123456A")[3:]
+            return httpx.Response(200, json=[{**SAMPLE_PROVIDER, "provider_id": pid}])
+
+        fake = SupabaseDB("http://supabase.bench", "bench-key", transport=httpx.MockTransport(handler))
+        server.providers_repo.db = fake
+        original_cache = server.provider_cache
+        ids = [f"{i:06d}A" for i in range(providers)]
+        rows = []
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for label, cache in (("uncached", ProviderCache(max_bytes=0)), ("cached", ProviderCache())):
+                server.provider_cache = cache
+                calls["n"] = 0
+                sem = asyncio.Semaphore(in_flight)
+
+                async def one(i):
+                    async with sem:
+                        r = await client.get(f"/api/provider/{ids[i % providers]}")
+                        assert r.status_code == 200, r.text
+
+                start = time.perf_counter()
+                await asyncio.gather(*(one(i) for i in range(requests)))
+                elapsed = time.perf_counter() - start
+                stats = cache.stats()
+                rows.append({
+                    "mode": label,
+                    "req/s": f"{requests / elapsed:8.1f}",
+                    "db_calls": calls["n"],
+                    "hit_ratio": stats["hit_ratio"],
+                    "cache_bytes": stats["bytes"],
+                })
+        server.provider_cache = original_cache
+        await fake.aclose()
+        self.report(f"Provider cache ({providers} providers, {requests} lookups)", rows)
+
+    async def bench_wallet_concurrency(self, updates=1000, retries=100, coalesce_ms=(0, 5)):
+        """1000 concurrent PATCH /api/provider/{id}/wallet: exact final balance, retries not re-applied"""
+        rows = []
+        amounts = [Decimal(random.randint(1, 100000)) / 100 for _ in range(updates)]
+        expected = sum(amounts, Decimal("0.00"))
+        original_writer = server.wallet_writer
+        for interval_ms in coalesce_ms:
+            state = {"balance": Decimal("0.00"), "ledger": {}, "rpc_calls": 0}
+            fake = SupabaseDB("http://supabase.bench", "bench-key", transport=self.fake_wallet_rpc(state))
+            server.wallet_ledger.db = fake
+            server.wallet_writer = CreditCoalescer(server.wallet_ledger, interval_ms / 1000) if interval_ms else server.wallet_ledger
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+                async def patch(i):
+                    r = await client.patch(
+                        f"/api/provider/{SAMPLE_PROVIDER['provider_id']}/wallet",
+                        params={"amount": str(amounts[i])},
+                        headers={"Idempotency-Key": f"bench-{i}"},
+                    )
+                    assert r.status_code == 200, r.text
+                    return r.json()
+
+                start = time.perf_counter()
+                await asyncio.gather(*(patch(i) for i in range(updates)))
+                elapsed = time.perf_counter() - start
+                rpc_calls = state["rpc_calls"]
+                replays = await asyncio.gather(*(patch(i) for i in random.sample(range(updates), retries)))
+            await fake.aclose()
+            rows.append({
+                "coalesce_ms": interval_ms,
+                "updates": updates,
+                "rpc_calls": rpc_calls,
+                "req/s": f"{updates / elapsed:8.1f}",
+                "balance_exact": state["balance"] == expected,
+                "ledger_rows": len(state["ledger"]),
+                "replays_applied": sum(r["applied"] for r in replays),
+            })
+            assert state["balance"] == expected and len(state["ledger"]) == updates, "wallet balance drifted"
+            assert not any(r["applied"] for r in replays), "idempotent retry was re-applied"
+        server.wallet_writer = original_writer
+        self.report(f"Concurrent wallet updates (simulated PostgREST latency {self.latency * 1000:.0f} ms)", rows)
+
+    async def bench_email_verification(self, events=2000, emails=500, batch_ms=(25,)):
+        """Burst of auth webhook events (duplicates + retries) through the write-behind queue"""
+        rows = []
+        original_queue = server.email_verification
+        burst = [(f"user{i % emails}@bench.test", f"2025-01-01T00:00:{i % emails % 60:02d}Z") for i in range(events)]
+        random.shuffle(burst)
+        for interval_ms in batch_ms:
+            state = {"verified": set(), "writes": 0, "rpc_calls": 0}
+            fake = SupabaseDB("http://supabase.bench", "bench-key", transport=self.fake_verify_rpc(state))
+            server.email_verification = EmailVerificationQueue(fake, interval=interval_ms / 1000)
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+                async def deliver(email, confirmed_at):
+                    r = await client.post("/api/supabase/auth-webhook", json={"email": email, "email_confirmed_at": confirmed_at})
+                    assert r.status_code == 200 and r.json()["updated"] == 1, r.text
+                start = time.perf_counter()
+                await asyncio.gather(*(deliver(*event) for event in burst))
+                elapsed = time.perf_counter() - start
+                # Supabase retries after the burst has been applied
+                await asyncio.gather(*(deliver(*event) for event in burst[:emails]))
+            snapshot = server.email_verification.snapshot()
+            await fake.aclose()
+            rows.append({
+                "batch_ms": interval_ms,
+                "events": events + emails,
+                "single_row_updates_before": events + emails,
+                "rpc_calls": state["rpc_calls"],
+                "rows_written": state["writes"],
+                "replayed": snapshot["replayed"],
+                "flush_p95_ms": snapshot["flushes"]["p95_ms"],
+                "events/s": f"{events / elapsed:8.1f}",
+            })
+            assert state["writes"] == emails, "an email was written more than once"
+        server.email_verification = original_queue
+        self.report(f"Email verification write-behind (simulated PostgREST latency {self.latency * 1000:.0f} ms)", rows)
+
+    async def bench_render_throughput(self, renders=200, workers=None):
+        """QR + ID card renders per second per core (cold and memoised)"""
+        workers = workers or os.cpu_count() or 1
+        rows = []
+
+        render_provider_assets("000000A", "9876543210", ["electrician"])  # warm fonts/template
+        start = time.perf_counter()
+        for i in range(renders):
+            render_provider_assets(f"{i:06d}A", "9876543210", ["electrician", "plumber"])
+        elapsed = time.perf_counter() - start
+        rows.append({"mode": "inline", "cores": 1, "renders/s/core": f"{renders / elapsed:8.1f}"})
+
+        engine = RenderEngine(workers=workers)
+        await engine.render("000000A", "9876543210", ["electrician"])  # spin up the pool
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            engine.render(f"{i:06d}B", "9876543210", ["electrician", "plumber"]) for i in range(renders)
+        ))
+        elapsed = time.perf_counter() - start
+        rows.append({"mode": "process_pool", "cores": workers, "renders/s/core": f"{renders / elapsed / workers:8.1f}"})
+
+        start = time.perf_counter()
+        for i in range(renders):
+            await engine.render(f"{i:06d}B", "9876543210", ["electrician", "plumber"])
+        elapsed = time.perf_counter() - start
+        rows.append({"mode": "memoised", "cores": 1, "renders/s/core": f"{renders / elapsed:8.1f}"})
+        engine.shutdown()
+        self.report("QR + ID card rendering", rows)
+
+    def bench_provider_serialisation(self, rows=1000, rounds=5):
+        """1000-row provider payloads: Provider model + json vs trusted rows + fast encoder"""
+        blob = "A" * 12000  # a base64 QR code is ~10-15 KB
+        payload = [
+            {**SAMPLE_PROVIDER, "id": f"00000000-0000-0000-0000-{i:012d}", "provider_id": f"{i:06d}A",
+             "qr_code": blob, "id_card_path": "sha256:" + "ab" * 32,
+             "documents": {"aadhaar_card": "sha256:" + "cd" * 32, "work_sample": "sha256:" + "ef" * 32}}
+            for i in range(rows)
+        ]
+        paths = (
+            ("Provider(**row) + json", lambda: json.dumps([server.Provider(**row).model_dump(mode="json") for row in payload]).encode()),
+            ("trusted rows + fastjson", lambda: fastjson.dumps([server.provider_payload(row) for row in payload])),
+        )
+        results = []
+        for name, encode in paths:
+            body = encode()
+            start = time.perf_counter()
+            for _ in range(rounds):
+                encode()
+            elapsed = (time.perf_counter() - start) / rounds
+            results.append({"path": name, "ms/response": f"{elapsed * 1000:7.2f}", "us/row": f"{elapsed / rows * 1e6:6.2f}", "bytes": len(body)})
+        self.report(f"Provider list serialisation ({rows} rows, fastjson backend: {'orjson' if fastjson.orjson else 'json'})", results)
+
+    def bench_profession_rules(self, registrations=100000, batch=1000):
+        """Profession validation + status cost per registration (compiled table)"""
+        table = server.profession_rules.current()
+        names = list(table.rules)
+        rng = random.Random(7)
+        rows = [
+            (rng.sample(names, rng.randint(1, 3)), table.provided(trade_license=rng.random() < 0.5, health_permit=rng.random() < 0.5))
+            for _ in range(registrations)
+        ]
+        results = []
+        for mode, evaluate in (("uncached", lambda p, d: table._evaluate_uncached(tuple(p), d)), ("memoised", table.evaluate)):
+            start = time.perf_counter()
+            for professions, provided in rows:
+                evaluate(professions, provided)
+            elapsed = time.perf_counter() - start
+            results.append({"mode": mode, "us/registration": f"{elapsed / registrations * 1e6:6.2f}"})
+        start = time.perf_counter()
+        for i in range(0, registrations, batch):
+            table.evaluate_many(rows[i:i + batch])
+        elapsed = time.perf_counter() - start
+        results.append({"mode": f"batch of {batch}", "us/registration": f"{elapsed / registrations * 1e6:6.2f}"})
+        start = time.perf_counter()
+        RuleTable(json.loads((BACKEND_DIR / "professions.json").read_text()))
+        results.append({"mode": "compile/reload", "us/registration": f"{(time.perf_counter() - start) * 1e6:6.2f} (once)"})
+        self.report("Profession rules", results)
+
+    def check_provider_id_collisions(self, processes=8, per_process=5000, block_size=64):
+        """Allocate IDs from several processes sharing one counter file; none may repeat"""
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = os.path.join(tmp, "provider_id.counter")
+            queue = multiprocessing.Queue()
+            workers = [
+                multiprocessing.Process(target=_allocate_ids, args=(state_file, per_process, block_size, queue))
+                for _ in range(processes)
+            ]
+            start = time.perf_counter()
+            for w in workers:
+                w.start()
+            ids = [pid for _ in workers for pid in queue.get()]
+            for w in workers:
+                w.join()
+            elapsed = time.perf_counter() - start
+        unique = len(set(ids))
+        well_formed = all(len(pid) == 7 and pid[:6].isdigit() and pid[6].isupper() for pid in ids)
+        self.report("Provider ID allocation across processes", [{
+            "processes": processes,
+            "ids": len(ids),
+            "unique": unique,
+            "well_formed": well_formed,
+            "ids/s": f"{len(ids) / elapsed:8.1f}",
+        }])
+        assert unique == len(ids) and well_formed, "provider ID collision detected"
+
+    async def run_all(self):
+        print("🚀 Starting Service Provider API Benchmarks...")
+        print("=" * 60)
+        await self.bench_get_provider_concurrency()
+        await self.bench_provider_cache()
+        await self.bench_wallet_concurrency()
+        await self.bench_email_verification()
+        await self.bench_render_throughput()
+        self.bench_profession_rules()
+        self.bench_provider_serialisation()
+        self.check_provider_id_collisions()
+        return 0
+
+
+def main():
+    bench = ServiceProviderBenchmark()
+    return asyncio.run(bench.run_all())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
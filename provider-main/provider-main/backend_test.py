@@ -192,10 +192,13 @@ class ServiceProviderAPITester:
             success = response.status_code == 200
             
             if success:
-                data = response.json()
-                has_id_card = 'id_card' in data and data['id_card']
-                success = has_id_card
-                details = f"ID card available: {has_id_card}"
+                is_png = response.headers.get('content-type') == 'image/png' and response.content[:8] == b'\x89PNG\r\n\x1a\n'
+                etag = response.headers.get('etag')
+                success = is_png and bool(etag)
+                if success:
+                    cached = requests.get(f"{self.api_url}/provider/{provider_id}/id-card", headers={"If-None-Match": etag})
+                    success = cached.status_code == 304
+                details = f"PNG: {is_png}, ETag: {etag}"
             else:
                 details = f"Status: {response.status_code}"
             
@@ -10,6 +10,8 @@ import { toast } from 'sonner';
 import { Download, User, MapPin, Phone, Mail, Award, Shield, QrCode, ArrowLeft, Edit, Check, X } from 'lucide-react';
 import { supabase, PROVIDER_DOCS_BUCKET } from '../lib/supabaseClient';
 
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+
 function Account() {
   const { providerId } = useParams();
   const navigate = useNavigate();
@@ -117,9 +119,12 @@ function Account() {
         toast.error('ID card not available');
         return;
       }
+      const isContentId = provider.id_card_path.startsWith('sha256:');
       const isBase64 = provider.id_card_path.length > 100 && !provider.id_card_path.includes('/');
       let href = '';
-      if (isBase64) {
+      if (isContentId) {
+        href = `${BACKEND_URL}/api/provider/${providerId}/id-card`;
+      } else if (isBase64) {
         href = `data:image/png;base64,${provider.id_card_path}`;
       } else {
         const { data, error } = await supabase.storage.from(PROVIDER_DOCS_BUCKET).createSignedUrl(provider.id_card_path, 60);
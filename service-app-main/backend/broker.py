@@ -0,0 +1,230 @@
+"""Pub/sub fan-out for WebSocket chat across workers.
+
+Any worker publishes a message to a channel such as ``user:<id>`` or
+``booking:<id>``; the worker that holds a socket subscribed to that
+channel delivers it. ``InProcessBroker`` serves a single process;
+``RedisBroker`` spans workers and nodes through Redis (or a compatible
+server). ``ConnectionRegistry`` tracks local sockets per channel and gives
+each one a bounded outbox so a slow consumer cannot hold up the others;
+a consumer that overflows it is disconnected so it reconnects and resyncs
+rather than silently missing messages.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # optional, only needed for CHAT_BROKER=redis
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+
+class InProcessBroker:
+    """Delivers published messages to handlers in this process only."""
+
+    def __init__(self):
+        self._handlers: Dict[str, Set[Handler]] = {}
+        self.published = 0
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self._handlers.setdefault(channel, set()).add(handler)
+
+    async def unsubscribe(self, channel: str, handler: Handler):
+        handlers = self._handlers.get(channel)
+        if handlers is not None:
+            handlers.discard(handler)
+            if not handlers:
+                del self._handlers[channel]
+
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        self.published += 1
+        for handler in list(self._handlers.get(channel, ())):
+            await handler(channel, message)
+
+    async def aclose(self):
+        self._handlers.clear()
+
+
+class RedisBroker:
+    """Redis pub/sub; one connection per worker listens on its subscribed channels."""
+
+    def __init__(self, client, prefix: str = "chat"):
+        self.client = client
+        self.prefix = prefix
+        self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self._handlers: Dict[str, Set[Handler]] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self.published = 0
+
+    async def subscribe(self, channel: str, handler: Handler):
+        handlers = self._handlers.setdefault(channel, set())
+        if not handlers:
+            await self._pubsub.subscribe(f"{self.prefix}:{channel}")
+        handlers.add(handler)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def unsubscribe(self, channel: str, handler: Handler):
+        handlers = self._handlers.get(channel)
+        if handlers is None:
+            return
+        handlers.discard(handler)
+        if not handlers:
+            del self._handlers[channel]
+            await self._pubsub.unsubscribe(f"{self.prefix}:{channel}")
+
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        self.published += 1
+        await self.client.publish(f"{self.prefix}:{channel}", json.dumps(message, ensure_ascii=False))
+
+    async def _listen(self):
+        while self._handlers:
+            try:
+                event = await self._pubsub.get_message(timeout=1.0)
+            except Exception as e:
+                logger.warning("Broker listener error: %s", e)
+                await asyncio.sleep(1)
+                continue
+            if event is None:
+                continue
+            channel = event["channel"]
+            channel = channel.decode() if isinstance(channel, bytes) else channel
+            channel = channel[len(self.prefix) + 1:]
+            try:
+                message = json.loads(event["data"])
+            except ValueError:
+                continue
+            for handler in list(self._handlers.get(channel, ())):
+                await handler(channel, message)
+
+    async def aclose(self):
+        self._handlers.clear()
+        if self._listener is not None:
+            self._listener.cancel()
+        await self._pubsub.aclose()
+        await self.client.aclose()
+
+
+def broker_from_env():
+    """Broker selected by CHAT_BROKER (memory, the default, or redis)."""
+    if os.environ.get("CHAT_BROKER", "memory") == "redis":
+        if aioredis is None:
+            raise RuntimeError("CHAT_BROKER=redis requires the redis package")
+        return RedisBroker(aioredis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379/0")))
+    return InProcessBroker()
+
+
+class Outbox:
+    """Bounded per-socket send queue drained by one writer task.
+
+    When the queue is full the consumer is disconnected. With ``max_drops``
+    above zero, up to that many frames in a row are dropped (oldest first)
+    before disconnecting, for channels where losing a frame is acceptable.
+    """
+
+    def __init__(self, send: Callable[[Dict[str, Any]], Awaitable[None]],
+                 close: Callable[[], Awaitable[None]], maxsize: int = 256, max_drops: int = 0):
+        self.send = send
+        self.close = close
+        self.max_drops = max_drops
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize)
+        self.delivered = self.dropped = 0
+        self._drops_in_row = 0
+        self._closer: Optional[asyncio.Task] = None
+        self._writer = asyncio.create_task(self._drain())
+
+    def offer(self, frame: Dict[str, Any]) -> bool:
+        """Queue a frame without waiting; returns False if the consumer was cut off."""
+        if self._writer.done():
+            return False
+        if self.queue.full():
+            if self._drops_in_row >= self.max_drops:
+                self._writer.cancel()
+                self._closer = asyncio.create_task(self.close())
+                return False
+            self.queue.get_nowait()
+            self.dropped += 1
+            self._drops_in_row += 1
+        self.queue.put_nowait(frame)
+        return True
+
+    async def _drain(self):
+        while True:
+            frame = await self.queue.get()
+            try:
+                await self.send(frame)
+            except Exception:
+                return
+            self.delivered += 1
+            self._drops_in_row = 0
+
+    async def aclose(self):
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+
+
+class ConnectionRegistry:
+    """Local sockets per channel; subscribes the broker while a channel has sockets here."""
+
+    def __init__(self, broker, outbox_size: int = 256, max_drops: int = 0):
+        self.broker = broker
+        self.outbox_size = outbox_size
+        self.max_drops = max_drops
+        self._channels: Dict[str, Set[Outbox]] = {}
+        self.delivered = self.cut_off = 0
+
+    async def register(self, channels: Iterable[str], send, close) -> Outbox:
+        outbox = Outbox(send, close, self.outbox_size, self.max_drops)
+        for channel in channels:
+            members = self._channels.setdefault(channel, set())
+            if not members:
+                await self.broker.subscribe(channel, self._deliver)
+            members.add(outbox)
+        return outbox
+
+    async def unregister(self, outbox: Outbox):
+        await outbox.aclose()
+        for channel in [c for c, members in self._channels.items() if outbox in members]:
+            members = self._channels[channel]
+            members.discard(outbox)
+            if not members:
+                del self._channels[channel]
+                await self.broker.unsubscribe(channel, self._deliver)
+
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        await self.broker.publish(channel, message)
+
+    async def _deliver(self, channel: str, message: Dict[str, Any]):
+        frame = {**message, "channel": channel}
+        for outbox in list(self._channels.get(channel, ())):
+            if outbox.offer(frame):
+                self.delivered += 1
+            else:
+                self.cut_off += 1
+
+    def stats(self) -> Dict[str, Any]:
+        outboxes = {o for members in self._channels.values() for o in members}
+        return {
+            "channels": len(self._channels),
+            "sockets": len(outboxes),
+            "queued": sum(o.queue.qsize() for o in outboxes),
+            "delivered": self.delivered,
+            "dropped": sum(o.dropped for o in outboxes),
+            "cut_off": self.cut_off,
+            "published": self.broker.published,
+        }
+
+    async def aclose(self):
+        for outbox in {o for members in self._channels.values() for o in members}:
+            await outbox.aclose()
+        self._channels.clear()
+        await self.broker.aclose()
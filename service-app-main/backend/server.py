@@ -1,16 +1,28 @@
-from fastapi import FastAPI, APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
+import functools
+import hashlib
+import hmac
+import json
 import logging
+import sys
+import time
+import unicodedata
+from collections import OrderedDict, deque
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import aiohttp
+import jwt
+
+from broker import ConnectionRegistry, broker_from_env
 
 
 ROOT_DIR = Path(__file__).parent
@@ -22,6 +34,61 @@ SUPABASE_SERVICE_ROLE_KEY: Optional[str] = os.environ.get('SUPABASE_SERVICE_ROLE
 
 use_supabase = bool(SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY)
 
+# Auth headers for Supabase REST, built once per process
+SUPABASE_HEADERS = {
+    "apikey": SUPABASE_SERVICE_ROLE_KEY,
+    "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
+} if use_supabase else {}
+
+OPENAI_API_KEY: Optional[str] = os.environ.get("OPENAI_API_KEY")
+OPENAI_HEADERS = {
+    "Authorization": f"Bearer {OPENAI_API_KEY}",
+    "Content-Type": "application/json",
+} if OPENAI_API_KEY else {}
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+LLM_TIMEOUT = aiohttp.ClientTimeout(total=15)
+# Streamed replies may run longer overall; each chunk must arrive within sock_read
+LLM_STREAM_TIMEOUT = aiohttp.ClientTimeout(total=60, sock_connect=3, sock_read=15)
+LLM_STREAM = os.environ.get("LLM_STREAM", "true").lower() in ("1", "true", "yes")
+OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+# Bump when the system prompts change so cached replies are not reused
+PROMPT_VERSION = "1"
+
+# Shared HTTP session (created on startup, closed on shutdown)
+http_session: Optional[aiohttp.ClientSession] = None
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Return the process-wide pooled session, creating it if needed."""
+    global http_session
+    if http_session is None or http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=int(os.environ.get("HTTP_POOL_LIMIT", "100")),
+            limit_per_host=int(os.environ.get("HTTP_POOL_LIMIT_PER_HOST", "32")),
+            ttl_dns_cache=300,
+            keepalive_timeout=30,
+        )
+        http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=10, connect=3),
+        )
+    return http_session
+
+class PrecomputedJSON:
+    """JSON body encoded once and served with a strong ETag (304 on If-None-Match)."""
+
+    def __init__(self, data, cache_control: str = "public, max-age=60"):
+        self.body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+        self.cache_control = cache_control
+
+    def response(self, request: Request) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": self.cache_control}
+        if_none_match = request.headers.get("if-none-match", "")
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        if if_none_match.strip() == "*" or self.etag in tags or f"W/{self.etag}" in tags:
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
 db = None
 client = None
 if not use_supabase:
@@ -50,9 +117,11 @@ class StatusCheckCreate(BaseModel):
     client_name: str
 
 # Add your routes to the router instead of directly to app
+root_response = PrecomputedJSON({"message": "Hello World"}, "public, max-age=3600")
+
 @api_router.get("/")
-async def root():
-    return {"message": "Hello World"}
+async def root(request: Request):
+    return root_response.response(request)
 
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
@@ -60,24 +129,22 @@ async def create_status_check(input: StatusCheckCreate):
     if use_supabase:
         # Insert via Supabase REST
         insert_payload = status_obj.dict()
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{SUPABASE_URL}/rest/v1/status_checks",
-                json=insert_payload,
-                headers={
-                    "apikey": SUPABASE_SERVICE_ROLE_KEY,
-                    "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-                    "Content-Type": "application/json",
-                    "Prefer": "return=representation"
-                },
-            ) as resp:
-                if resp.status >= 300:
-                    text = await resp.text()
-                    raise HTTPException(status_code=500, detail=f"Supabase insert failed: {text}")
-                data = await resp.json()
-                # Supabase returns a list of inserted rows
-                row = data[0] if isinstance(data, list) and data else insert_payload
-                return StatusCheck(**row)
+        async with get_http_session().post(
+            f"{SUPABASE_URL}/rest/v1/status_checks",
+            data=status_obj.json(),
+            headers={
+                **SUPABASE_HEADERS,
+                "Content-Type": "application/json",
+                "Prefer": "return=representation"
+            },
+        ) as resp:
+            if resp.status >= 300:
+                text = await resp.text()
+                raise HTTPException(status_code=500, detail=f"Supabase insert failed: {text}")
+            data = await resp.json()
+            # Supabase returns a list of inserted rows
+            row = data[0] if isinstance(data, list) and data else insert_payload
+            return StatusCheck(**row)
     else:
         if not db:
             raise HTTPException(status_code=500, detail="Database not configured")
@@ -87,33 +154,32 @@ async def create_status_check(input: StatusCheckCreate):
 @api_router.get("/status", response_model=List[StatusCheck])
 async def get_status_checks():
     if use_supabase:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{SUPABASE_URL}/rest/v1/status_checks?select=*",
-                headers={
-                    "apikey": SUPABASE_SERVICE_ROLE_KEY,
-                    "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}"
-                },
-            ) as resp:
-                if resp.status >= 300:
-                    text = await resp.text()
-                    raise HTTPException(status_code=500, detail=f"Supabase fetch failed: {text}")
-                data = await resp.json()
-                return [StatusCheck(**row) for row in data]
+        async with get_http_session().get(
+            f"{SUPABASE_URL}/rest/v1/status_checks?select=*",
+            headers=SUPABASE_HEADERS,
+        ) as resp:
+            if resp.status >= 300:
+                text = await resp.text()
+                raise HTTPException(status_code=500, detail=f"Supabase fetch failed: {text}")
+            data = await resp.json()
+            return [StatusCheck(**row) for row in data]
     else:
         if not db:
             raise HTTPException(status_code=500, detail="Database not configured")
         status_checks = await db.status_checks.find().to_list(1000)
         return [StatusCheck(**status_check) for status_check in status_checks]
 
+# Mock metrics data matching frontend expectations (encoded once)
+metrics_overview_response = PrecomputedJSON({
+    "labels": ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"],
+    "users": [12, 19, 7, 14, 20, 25, 22],
+    "providers": [5, 9, 11, 8, 12, 15, 17]
+})
+
 @api_router.get("/metrics/overview")
-async def get_metrics_overview():
+async def get_metrics_overview(request: Request):
     """Returns mock metrics data matching frontend expectations"""
-    return {
-        "labels": ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"],
-        "users": [12, 19, 7, 14, 20, 25, 22],
-        "providers": [5, 9, 11, 8, 12, 15, 17]
-    }
+    return metrics_overview_response.response(request)
 
 # Favicon endpoint to suppress 404 errors
 @app.get("/favicon.ico", include_in_schema=False)
@@ -138,8 +204,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_http_session():
+    get_http_session()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Write buffered chat transcripts while the HTTP session is still open
+    await transcript_writer.aclose()
+    await chat_registry.aclose()
+    if http_session and not http_session.closed:
+        await http_session.close()
     if client:
         client.close()
 
@@ -169,10 +244,8 @@ def _generate_reply(text: str, lang: str) -> str:
             return "We offer Plumbing, Electrical, Home Cleaning, and Painting. Which service do you need help with?"
         return f"I am here to help. You said: {text}"
 
-async def _llm_reply(text: str, lang: str) -> str:
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        return None
+def _llm_payload(text: str, lang: str, history: Sequence[Tuple[bool, str]] = ()) -> dict:
+    """Chat-completions request; ``history`` is (from_user, text) turns, oldest first."""
     system_en = (
         "You are Fixora's helpful assistant for a local services marketplace (plumbing, electrical, home cleaning, painting). "
         "Always reply concisely and help the user find or book providers."
@@ -184,51 +257,671 @@ async def _llm_reply(text: str, lang: str) -> str:
     system_prompt = system_kn if lang == "kn" else system_en
     user_prefix = "ಬಳಕೆದಾರ: " if lang == "kn" else "User: "
 
-    payload = {
-        "model": os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
+    messages = [{"role": "system", "content": system_prompt}]
+    for from_user, turn in history:
+        messages.append({"role": "user", "content": f"{user_prefix}{turn}"} if from_user else {"role": "assistant", "content": turn})
+    messages.append({"role": "user", "content": f"{user_prefix}{text}"})
+    return {
+        "model": OPENAI_MODEL,
         "temperature": 0.3,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"{user_prefix}{text}"},
-        ],
+        "messages": messages,
     }
+
+async def _llm_reply(text: str, lang: str, history: Sequence[Tuple[bool, str]] = ()) -> str:
+    if not OPENAI_API_KEY:
+        return None
+    payload = _llm_payload(text, lang, history)
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15)) as session:
-            async with session.post(
-                "https://api.openai.com/v1/chat/completions",
-                json=payload,
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                },
-            ) as resp:
-                if resp.status >= 300:
-                    txt = await resp.text()
-                    logger.warning("OpenAI error %s: %s", resp.status, txt)
-                    return None
-                data = await resp.json()
-                content = data.get("choices", [{}])[0].get("message", {}).get("content")
-                return content or None
+        async with get_http_session().post(
+            f"{OPENAI_BASE_URL}/chat/completions",
+            json=payload,
+            headers=OPENAI_HEADERS,
+            timeout=LLM_TIMEOUT,
+        ) as resp:
+            if resp.status >= 300:
+                txt = await resp.text()
+                logger.warning("OpenAI error %s: %s", resp.status, txt)
+                return None
+            data = await resp.json()
+            content = data.get("choices", [{}])[0].get("message", {}).get("content")
+            return content or None
     except Exception as e:
         logger.warning("LLM call failed: %s", e)
         return None
 
+class LLMStreamError(Exception):
+    """The completion stream returned an error status or a malformed event."""
+
+class LLMStreamInterrupted(Exception):
+    """The stream failed after deltas were sent; ``partial`` is the text the client has."""
+
+    def __init__(self, partial: str):
+        super().__init__("LLM stream interrupted")
+        self.partial = partial
+
+async def _llm_stream(text: str, lang: str, history: Sequence[Tuple[bool, str]] = ()) -> AsyncIterator[str]:
+    """Yield content deltas from the chat-completions SSE stream as they arrive."""
+    payload = {**_llm_payload(text, lang, history), "stream": True}
+    async with get_http_session().post(
+        f"{OPENAI_BASE_URL}/chat/completions",
+        json=payload,
+        headers=OPENAI_HEADERS,
+        timeout=LLM_STREAM_TIMEOUT,
+    ) as resp:
+        if resp.status >= 300:
+            raise LLMStreamError(f"OpenAI error {resp.status}: {await resp.text()}")
+        # aiohttp yields the body line by line; SSE events are "data: {...}" lines
+        async for line in resp.content:
+            line = line.strip()
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                return
+            try:
+                choice = (json.loads(data).get("choices") or [{}])[0]
+                delta = (choice.get("delta") or {}).get("content")
+            except (ValueError, KeyError, IndexError, AttributeError, TypeError) as e:
+                raise LLMStreamError(f"Malformed stream event: {data[:100]!r}") from e
+            if delta is not None and not isinstance(delta, str):
+                raise LLMStreamError(f"Malformed stream event: {data[:100]!r}")
+            if delta:
+                yield delta
+
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+async def _stream_reply(send: Send, text: str, lang: str, history: Sequence[Tuple[bool, str]] = ()) -> Optional[str]:
+    """Forward LLM deltas through ``send``; returns the full reply.
+
+    Returns None if the LLM fails before any delta was sent; a failure
+    mid-stream raises LLMStreamInterrupted with the text sent so far, so the
+    reply is finalised with it (and not cached) instead of being replaced.
+    """
+    parts: List[str] = []
+    try:
+        async for delta in _llm_stream(text, lang, history):
+            parts.append(delta)
+            await send({"sender": "bot", "delta": delta})
+    except (aiohttp.ClientError, asyncio.TimeoutError, LLMStreamError) as e:
+        logger.warning("LLM stream failed after %d deltas: %s", len(parts), e)
+        if parts:
+            raise LLMStreamInterrupted("".join(parts)) from e
+        return None
+    return "".join(parts) or None
+
+def normalise_question(text: str) -> str:
+    """Case-fold, drop punctuation and collapse whitespace (Kannada marks are kept)."""
+    t = unicodedata.normalize("NFKC", text).casefold()
+    t = "".join(ch for ch in t if not unicodedata.category(ch).startswith("P"))
+    return " ".join(t.split())
+
+class ReplyCache:
+    """LLM replies keyed by (normalised text, lang, model, prompt version).
+
+    LRU bounded by ``max_bytes`` with a TTL; concurrent identical questions
+    share one upstream call. Failed calls (None) are not cached.
+    """
+
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024, ttl: float = 3600.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, str, str, str], Tuple[float, int, str]]" = OrderedDict()
+        self._loading: Dict[Tuple[str, str, str, str], asyncio.Future] = {}
+        self._bytes = 0
+        self.hits = self.misses = self.shared = self.evictions = 0
+
+    @staticmethod
+    def key(text: str, lang: str) -> Tuple[str, str, str, str]:
+        return (normalise_question(text), lang, OPENAI_MODEL, PROMPT_VERSION)
+
+    def get(self, key) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry[0]:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def put(self, key, reply: str):
+        size = len(key[0].encode()) + len(reply.encode())
+        if size > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, reply)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    async def get_or_load(self, key, load: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        reply = self.get(key)
+        if reply is not None:
+            self.hits += 1
+            return reply
+        pending = self._loading.get(key)
+        if pending is not None:
+            # Followers get the leader's full reply (not its deltas)
+            self.shared += 1
+            return await asyncio.shield(pending)
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            reply = await load()
+        except BaseException:
+            # Followers fall back on their own; the leader may just have been cancelled
+            future.set_result(None)
+            raise
+        finally:
+            self._loading.pop(key, None)
+        if reply:
+            self.put(key, reply)
+        future.set_result(reply)
+        return reply
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.shared
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "hit_ratio": round((self.hits + self.shared) / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+        }
+
+reply_cache = ReplyCache(
+    max_bytes=int(os.environ.get("CHAT_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+    ttl=float(os.environ.get("CHAT_CACHE_TTL", "3600")),
+)
+
+class LLMLimiter:
+    """Process-wide cap on concurrent upstream LLM calls with a bounded wait queue.
+
+    Calls that find the queue full, or wait longer than ``wait_timeout``,
+    return None at once so the caller can use the rule-based reply.
+    """
+
+    def __init__(self, max_concurrent: int = 16, max_waiting: int = 64, wait_timeout: float = 2.0):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = self.waiting = 0
+        self.calls = self.rejected = self.timed_out = 0
+        self.waits: Deque[float] = deque(maxlen=1024)
+
+    async def run(self, call: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        started = time.perf_counter()
+        if not self._semaphore.locked():
+            # Free slot: acquire() returns without yielding
+            await self._semaphore.acquire()
+        elif self.waiting >= self.max_waiting:
+            self.rejected += 1
+            return None
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.wait_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                return None
+            finally:
+                self.waiting -= 1
+        self.waits.append((time.perf_counter() - started) * 1000)
+        self.calls += 1
+        self.in_flight += 1
+        try:
+            return await call()
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.waits)
+
+        def pct(p: float) -> Optional[float]:
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 2) if ordered else None
+
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_waiting": self.max_waiting,
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "queue_wait_p50_ms": pct(0.50),
+            "queue_wait_p95_ms": pct(0.95),
+        }
+
+llm_limiter = LLMLimiter(
+    max_concurrent=int(os.environ.get("LLM_MAX_CONCURRENCY", "16")),
+    max_waiting=int(os.environ.get("LLM_MAX_WAITING", "64")),
+    wait_timeout=float(os.environ.get("LLM_QUEUE_TIMEOUT", "2")),
+)
+
+async def _chat_reply(send: Send, text: str, lang: str, stream: bool = True,
+                      history: Sequence[Tuple[bool, str]] = ()) -> str:
+    """LLM reply if configured (rate-limited; cached for opening questions), else the rule-based reply."""
+    reply = None
+    if OPENAI_API_KEY:
+        if LLM_STREAM and stream:
+            load = functools.partial(_stream_reply, send, text, lang, history)
+        else:
+            load = functools.partial(_llm_reply, text, lang, history)
+        limited = functools.partial(llm_limiter.run, load)
+        try:
+            # A reply that depends on earlier turns is not reusable for other users
+            reply = await (limited() if history else reply_cache.get_or_load(ReplyCache.key(text, lang), limited))
+        except LLMStreamInterrupted as e:
+            # The client already shows these deltas; finalise with them
+            return e.partial
+    return reply or _generate_reply(text, lang)
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 UTF-8 bytes per token; Kannada costs more per character)."""
+    return len(text.encode()) // 4 + 1
+
+class ConversationMemory:
+    """Recent turns of one conversation in a fixed-size ring, trimmed to a token budget.
+
+    Each turn is stored as (from_user, text, tokens) with text capped at
+    ``max_chars``, so memory per connection is bounded by
+    ``max_turns * max_chars`` regardless of how long the socket stays open.
+    """
+
+    __slots__ = ("_ring", "_start", "_count", "tokens", "token_budget", "max_chars")
+
+    def __init__(self, max_turns: int = 16, token_budget: int = 1024, max_chars: int = 2000):
+        self._ring: List[Optional[Tuple[bool, str, int]]] = [None] * max_turns
+        self._start = 0
+        self._count = 0
+        self.tokens = 0
+        self.token_budget = token_budget
+        self.max_chars = max_chars
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, from_user: bool, text: str):
+        text = text[:self.max_chars]
+        cost = estimate_tokens(text)
+        if self._count == len(self._ring):
+            self._pop_oldest()
+        self._ring[(self._start + self._count) % len(self._ring)] = (from_user, text, cost)
+        self._count += 1
+        self.tokens += cost
+        while self.tokens > self.token_budget and self._count > 1:
+            self._pop_oldest()
+
+    def _pop_oldest(self):
+        _, _, cost = self._ring[self._start]
+        self._ring[self._start] = None
+        self._start = (self._start + 1) % len(self._ring)
+        self._count -= 1
+        self.tokens -= cost
+
+    def turns(self) -> List[Tuple[bool, str]]:
+        """(from_user, text) oldest first."""
+        size = len(self._ring)
+        return [self._ring[(self._start + i) % size][:2] for i in range(self._count)]
+
+    def nbytes(self) -> int:
+        size = sys.getsizeof(self._ring)
+        for i in range(self._count):
+            turn = self._ring[(self._start + i) % len(self._ring)]
+            size += sys.getsizeof(turn) + sys.getsizeof(turn[1])
+        return size
+
+CHAT_HISTORY_TURNS = int(os.environ.get("CHAT_HISTORY_TURNS", "16"))
+CHAT_HISTORY_TOKENS = int(os.environ.get("CHAT_HISTORY_TOKENS", "1024"))
+CHAT_HISTORY_MAX_CHARS = int(os.environ.get("CHAT_HISTORY_MAX_CHARS", "2000"))
+# Transcripts are stored as messages between the user and this (bot) user ID
+CHATBOT_USER_ID: Optional[str] = os.environ.get("CHATBOT_USER_ID")
+
+class TranscriptWriter:
+    """Buffers transcript rows and writes them in batched inserts.
+
+    Rows are flushed every ``interval`` seconds or once ``max_batch`` are
+    pending; past ``max_pending`` new rows are dropped (and counted) rather
+    than growing memory while the database is down.
+    """
+
+    def __init__(self, insert: Callable[[List[Dict[str, Any]]], Awaitable[None]], *,
+                 interval: float = 1.0, max_batch: int = 500, max_pending: int = 10_000):
+        self.insert = insert
+        self.interval = interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._pending: List[Dict[str, Any]] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._flushes: set = set()
+        self.written = self.batches = self.dropped = self.failed = 0
+
+    def add(self, rows: List[Dict[str, Any]]):
+        if len(self._pending) + len(rows) > self.max_pending:
+            self.dropped += len(rows)
+            return
+        self._pending.extend(rows)
+        if len(self._pending) >= self.max_batch:
+            task = asyncio.create_task(self.flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        elif self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    async def flush(self):
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            try:
+                await self.insert(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                logger.warning("Transcript insert failed (%s rows): %s", len(batch), e)
+                continue
+            self.written += len(batch)
+            self.batches += 1
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "written": self.written, "batches": self.batches,
+                "dropped": self.dropped, "failed": self.failed}
+
+    async def aclose(self):
+        if self._flusher is not None:
+            await self._flusher
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
+
+async def _insert_messages(rows: List[Dict[str, Any]]):
+    if use_supabase:
+        async with get_http_session().post(
+            f"{SUPABASE_URL}/rest/v1/messages",
+            json=rows,
+            headers={**SUPABASE_HEADERS, "Content-Type": "application/json", "Prefer": "return=minimal"},
+        ) as resp:
+            if resp.status >= 300:
+                raise RuntimeError(f"Supabase insert failed: {resp.status} {await resp.text()}")
+    elif db is not None:
+        await db.messages.insert_many(rows)
+
+transcript_writer = TranscriptWriter(
+    _insert_messages,
+    interval=float(os.environ.get("CHAT_PERSIST_INTERVAL", "1")),
+    max_batch=int(os.environ.get("CHAT_PERSIST_BATCH", "500")),
+)
+
+# Supabase Auth signs access tokens with the project JWT secret (HS256)
+SUPABASE_JWT_SECRET: Optional[str] = os.environ.get("SUPABASE_JWT_SECRET")
+
+def verify_access_token(token: str) -> Optional[str]:
+    """User ID (``sub``) of a valid Supabase access token, else None."""
+    if not SUPABASE_JWT_SECRET:
+        logger.warning("SUPABASE_JWT_SECRET is not set; chat access tokens cannot be verified")
+        return None
+    try:
+        claims = jwt.decode(token, SUPABASE_JWT_SECRET, algorithms=["HS256"], audience="authenticated")
+    except jwt.PyJWTError as e:
+        logger.info("Rejected chat access token: %s", e)
+        return None
+    return claims.get("sub")
+
+async def is_booking_member(booking_id: str, user_id: str) -> bool:
+    """Whether the user made the booking or is its provider (checked in Supabase)."""
+    try:
+        uuid.UUID(booking_id)
+    except ValueError:
+        return False
+    if not use_supabase:
+        return False
+    session = get_http_session()
+    async with session.get(
+        f"{SUPABASE_URL}/rest/v1/bookings",
+        params={"id": f"eq.{booking_id}", "select": "user_id,provider_id"},
+        headers=SUPABASE_HEADERS,
+    ) as resp:
+        if resp.status >= 300:
+            logger.warning("Booking lookup failed: %s %s", resp.status, await resp.text())
+            return False
+        rows = await resp.json()
+    if not rows:
+        return False
+    if rows[0].get("user_id") == user_id:
+        return True
+    if not rows[0].get("provider_id"):
+        return False
+    async with session.get(
+        f"{SUPABASE_URL}/rest/v1/providers",
+        params={"provider_id": f"eq.{rows[0]['provider_id']}", "user_id": f"eq.{user_id}", "select": "provider_id"},
+        headers=SUPABASE_HEADERS,
+    ) as resp:
+        return resp.status < 300 and bool(await resp.json())
+
+def transcript_rows(booking_id: str, user_id: str, question: str, reply: str) -> List[Dict[str, Any]]:
+    """One user->bot and one bot->user ``messages`` row for a completed turn."""
+    now = datetime.now(timezone.utc)
+    asked = {"booking_id": booking_id, "sender_id": user_id, "receiver_id": CHATBOT_USER_ID,
+             "message": question, "message_type": "chatbot", "created_at": now.isoformat()}
+    answered = {**asked, "sender_id": CHATBOT_USER_ID, "receiver_id": user_id, "message": reply,
+                "created_at": (now + timedelta(microseconds=1)).isoformat()}
+    return [asked, answered]
+
+CHAT_MAX_IN_FLIGHT = int(os.environ.get("CHAT_MAX_IN_FLIGHT", "1"))
+
+# Sockets subscribe to user:<id> / booking:<id>; any worker can publish to them
+chat_registry = ConnectionRegistry(
+    broker_from_env(),
+    outbox_size=int(os.environ.get("CHAT_OUTBOX_SIZE", "256")),
+    max_drops=int(os.environ.get("CHAT_OUTBOX_MAX_DROPS", "0")),
+)
+CHAT_PUBLISH_TOKEN: Optional[str] = os.environ.get("CHAT_PUBLISH_TOKEN")
+
+class ChatSession:
+    """Message pipeline for one /ws/chat connection.
+
+    Each message is handled in its own task so the socket keeps reading.
+    When ``max_in_flight`` messages are pending, the oldest is cancelled
+    (superseded); ``{"cancel": id}`` cancels one explicitly. Replies echo
+    the client's ``id`` when one was sent. Completed turns feed the
+    conversation memory. Sockets opened with a Supabase ``access_token``
+    (query parameter or Authorization header) act as that user; with a
+    ``booking_id`` the user belongs to, turns also go to the batched
+    transcript writer. Those sockets also receive messages published to
+    their ``user:`` and ``booking:`` channels from any worker; a socket
+    whose token is invalid, or whose booking is not the user's, is closed
+    with 1008 before it subscribes.
+    """
+
+    active: set = set()
+    in_flight = 0
+    superseded = 0
+    cancelled = 0
+
+    def __init__(self, websocket: WebSocket, max_in_flight: int = 1):
+        self.websocket = websocket
+        self.max_in_flight = max(1, max_in_flight)
+        self.memory = ConversationMemory(CHAT_HISTORY_TURNS, CHAT_HISTORY_TOKENS, CHAT_HISTORY_MAX_CHARS)
+        # Set by authenticate() from the verified access token
+        self.user_id: Optional[str] = None
+        self.booking_id: Optional[str] = None
+        self._tasks: "OrderedDict[int, Tuple[Any, asyncio.Task]]" = OrderedDict()
+        self._seq = 0
+        self._send_lock = asyncio.Lock()
+        self._outbox = None
+        ChatSession.active.add(self)
+
+    def channels(self) -> List[str]:
+        """Channels this socket may see: its verified user and a booking they belong to."""
+        channels = []
+        if self.user_id:
+            channels.append(f"user:{self.user_id}")
+        if self.booking_id:
+            channels.append(f"booking:{self.booking_id}")
+        return channels
+
+    def access_token(self) -> Optional[str]:
+        token = self.websocket.query_params.get("access_token")
+        header = self.websocket.headers.get("authorization", "")
+        if not token and header.lower().startswith("bearer "):
+            token = header[7:].strip()
+        return token or None
+
+    async def authenticate(self) -> bool:
+        """Identify the user from the access token; keep the booking only if they belong to it.
+
+        Returns False when a token or booking was asked for but not granted.
+        """
+        token = self.access_token()
+        self.user_id = verify_access_token(token) if token else None
+        if token and not self.user_id:
+            return False
+        booking_id = self.websocket.query_params.get("booking_id")
+        if booking_id:
+            if not (self.user_id and await is_booking_member(booking_id, self.user_id)):
+                return False
+            self.booking_id = booking_id
+        return True
+
+    async def start(self) -> bool:
+        if not await self.authenticate():
+            # Policy violation: never subscribe to channels the user may not see
+            await self.websocket.close(1008)
+            return False
+        channels = self.channels()
+        if channels:
+            # Slow consumers are disconnected with 1013 (try again later)
+            self._outbox = await chat_registry.register(channels, self.send, functools.partial(self.websocket.close, 1013))
+        return True
+
+    async def send(self, frame: Dict[str, Any]):
+        async with self._send_lock:
+            await self.websocket.send_json(frame)
+
+    def receive(self, data: Dict[str, Any]):
+        if "cancel" in data:
+            for request_id, task in list(self._tasks.values()):
+                if request_id == data["cancel"]:
+                    ChatSession.cancelled += 1
+                    task.cancel()
+            return
+        while len(self._tasks) >= self.max_in_flight:
+            _, (_, oldest) = self._tasks.popitem(last=False)
+            if not oldest.done():
+                ChatSession.superseded += 1
+                oldest.cancel()
+        self._seq += 1
+        seq, request_id = self._seq, data.get("id")
+        task = asyncio.create_task(self._handle(request_id, data))
+        self._tasks[seq] = (request_id, task)
+        ChatSession.in_flight += 1
+        task.add_done_callback(lambda _, seq=seq: self._done(seq))
+
+    def _done(self, seq: int):
+        ChatSession.in_flight -= 1
+        self._tasks.pop(seq, None)
+
+    async def _handle(self, request_id: Any, data: Dict[str, Any]):
+        tag = {} if request_id is None else {"id": request_id}
+
+        async def send(frame: Dict[str, Any]):
+            await self.send({**frame, **tag})
+
+        try:
+            text = str(data.get("text", "")).strip()
+            lang = data.get("lang", "en")
+            if not text:
+                await send({"sender": "bot", "text": ""})
+                return
+            reply = await _chat_reply(send, text, lang, bool(data.get("stream", True)), self.memory.turns())
+            await send({"sender": "bot", "text": reply})
+            self.memory.append(True, text)
+            self.memory.append(False, reply)
+            if self.booking_id and self.user_id and CHATBOT_USER_ID:
+                transcript_writer.add(transcript_rows(self.booking_id, self.user_id, text, reply))
+        except asyncio.CancelledError:
+            if tag:
+                try:
+                    await send({"sender": "bot", "cancelled": True})
+                except Exception:
+                    pass
+            raise
+        except Exception as e:
+            # Usually the socket closed while the reply was in flight
+            logger.debug("Chat message failed: %s", e)
+
+    async def close(self):
+        ChatSession.active.discard(self)
+        if self._outbox is not None:
+            await chat_registry.unregister(self._outbox)
+        tasks = [task for _, task in self._tasks.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @classmethod
+    def stats(cls) -> dict:
+        history = [session.memory.nbytes() for session in cls.active]
+        return {
+            "sessions": len(cls.active),
+            "in_flight": cls.in_flight,
+            "superseded": cls.superseded,
+            "cancelled": cls.cancelled,
+            "history_bytes": sum(history),
+            "history_bytes_max": max(history, default=0),
+        }
+
+@app.get("/api/chat/metrics")
+async def chat_metrics():
+    """Reply cache hit ratio, LLM queue-wait/in-flight gauges, socket and transcript counters"""
+    return {
+        "reply_cache": reply_cache.stats(),
+        "llm": llm_limiter.snapshot(),
+        "chat": ChatSession.stats(),
+        "transcripts": transcript_writer.stats(),
+        "fanout": chat_registry.stats(),
+    }
+
+class PublishRequest(BaseModel):
+    channel: str = Field(pattern=r"^(user|booking):[\w-]+$")
+    message: Dict[str, Any]
+
+@app.post("/api/chat/publish")
+async def publish_chat_message(payload: PublishRequest, request: Request):
+    """Deliver a message to every socket on a user/booking channel, on any worker.
+    Requires the X-Publish-Token header to match CHAT_PUBLISH_TOKEN.
+    """
+    token = request.headers.get("x-publish-token")
+    if not CHAT_PUBLISH_TOKEN or not token or not hmac.compare_digest(token, CHAT_PUBLISH_TOKEN):
+        raise HTTPException(status_code=403, detail="Publishing is not allowed")
+    await chat_registry.publish(payload.channel, payload.message)
+    return {"published": True}
+
 # Real-time Chatbot WebSocket
 @app.websocket("/ws/chat")
 async def chat_ws(websocket: WebSocket):
     await websocket.accept()
+    session = ChatSession(websocket, CHAT_MAX_IN_FLIGHT)
     try:
+        if not await session.start():
+            return
         while True:
-            data = await websocket.receive_json()
-            text = data.get("text", "").strip()
-            lang = data.get("lang", "en")
-            if not text:
-                await websocket.send_json({"sender": "bot", "text": ""})
-                continue
-            # Try LLM first if configured; otherwise use rule-based reply
-            reply = await _llm_reply(text, lang)
-            if not reply:
-                reply = _generate_reply(text, lang)
-            await websocket.send_json({"sender": "bot", "text": reply})
+            # Messages are handled concurrently; a new one supersedes the oldest pending one
+            session.receive(await websocket.receive_json())
     except WebSocketDisconnect:
         return
+    finally:
+        await session.close()
@@ -0,0 +1,461 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from aiohttp import web
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+os.environ.pop("SUPABASE_URL", None)
+
+import server  # noqa: E402
+from broker import ConnectionRegistry, InProcessBroker, RedisBroker, aioredis  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+logging.getLogger("server").setLevel(logging.ERROR)
+
+
+class FakeCompletionServer:
+    """Local chat-completions endpoint: ``first_token_ms`` before the first
+    token, then ``tokens`` tokens ``token_ms`` apart (SSE when stream=true)."""
+
+    def __init__(self, first_token_ms=300.0, token_ms=20.0, tokens=40):
+        self.first_token = first_token_ms / 1000.0
+        self.token_gap = token_ms / 1000.0
+        self.tokens = tokens
+        self.calls = 0
+        self.active = self.max_active = 0
+        self.fail = False
+        self.url = None
+        self._loop = None
+        self._runner = None
+
+    def words(self):
+        return [f"word{i} " for i in range(self.tokens)]
+
+    async def completions(self, request):
+        self.calls += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            return await self.complete(request)
+        finally:
+            self.active -= 1
+
+    async def complete(self, request):
+        payload = await request.json()
+        if self.fail:
+            return web.Response(status=500, text="upstream unavailable")
+        await asyncio.sleep(self.first_token)
+        if not payload.get("stream"):
+            await asyncio.sleep(self.token_gap * (self.tokens - 1))
+            return web.json_response({"choices": [{"message": {"content": "".join(self.words())}}]})
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        for i, word in enumerate(self.words()):
+            if i:
+                await asyncio.sleep(self.token_gap)
+            event = {"choices": [{"index": 0, "delta": {"content": word}}]}
+            await resp.write(f"data: {json.dumps(event)}\n\n".encode())
+        await resp.write(b"data: [DONE]\n\n")
+        return resp
+
+    def start(self):
+        ready = threading.Event()
+
+        async def serve():
+            app = web.Application()
+            app.router.add_post("/v1/chat/completions", self.completions)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            self.url = f"http://127.0.0.1:{port}/v1"
+            ready.set()
+
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(serve(), self._loop)
+        ready.wait(5)
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+class ChatBenchmark:
+    """/ws/chat benchmarks against a local fake completion server."""
+
+    def __init__(self):
+        self.results = []
+
+    def report(self, name, rows):
+        print(f"\n{name}")
+        print("-" * 60)
+        for row in rows:
+            print("  " + "  ".join(f"{k}={v}" for k, v in row.items()))
+        self.results.append({"benchmark": name, "rows": rows})
+
+    @staticmethod
+    def pct(values, p):
+        ordered = sorted(values)
+        return f"{ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000:7.1f}"
+
+    def bench_time_to_first_token(self, fake, messages=20):
+        """Time from sending a question to the first frame (delta or full reply)"""
+        rows = []
+        server.OPENAI_BASE_URL = fake.url
+        with TestClient(server.app) as client, client.websocket_connect("/ws/chat") as ws:
+            for mode in ("buffered", "stream"):
+                ttft, total = [], []
+                for i in range(messages):
+                    start = time.perf_counter()
+                    ws.send_json({"text": f"{mode} question {i}", "lang": "en", "stream": mode == "stream"})
+                    first = None
+                    while True:
+                        frame = ws.receive_json()
+                        first = first or time.perf_counter()
+                        if "text" in frame:
+                            break
+                    assert frame["text"] == "".join(fake.words()), frame
+                    ttft.append(first - start)
+                    total.append(time.perf_counter() - start)
+                rows.append({
+                    "mode": mode,
+                    "ttft_p50_ms": self.pct(ttft, 0.50),
+                    "ttft_p95_ms": self.pct(ttft, 0.95),
+                    "reply_p50_ms": self.pct(total, 0.50),
+                })
+            # Upstream failure falls back to the rule-based reply
+            fake.fail = True
+            ws.send_json({"text": "fallback hello", "lang": "en"})
+            assert ws.receive_json()["text"] == server._generate_reply("fallback hello", "en")
+            fake.fail = False
+        self.report(
+            f"/ws/chat time to first token ({fake.first_token * 1000:.0f} ms to first token, "
+            f"{fake.tokens} tokens x {fake.token_gap * 1000:.0f} ms)",
+            rows,
+        )
+
+    async def bench_reply_cache(self, fake, concurrent=50, questions=2000):
+        """FAQ traffic through the reply cache: upstream calls, hit ratio, hit latency"""
+        server.OPENAI_BASE_URL = fake.url
+        server.reply_cache = cache = server.ReplyCache()
+        faqs = [
+            ("hi", "en"), ("Hello!", "en"), ("What is the price?", "en"), ("how do I book a plumber", "en"),
+            ("Which services do you provide?", "en"), ("ನಮಸ್ಕಾರ", "kn"), ("ಬೆಲೆ ಎಷ್ಟು?", "kn"), ("ಬುಕ್ ಮಾಡುವುದು ಹೇಗೆ", "kn"),
+        ]
+
+        def variants(q):
+            return [q, q.upper(), f"  {q}  ", f"{q}?!"]
+
+        try:
+            calls = fake.calls
+            burst = [v for v in variants("What is the price") for _ in range(concurrent // 4)]
+            replies = await asyncio.gather(*(
+                cache.get_or_load(cache.key(q, "en"), lambda q=q: server._llm_reply(q, "en")) for q in burst
+            ))
+            burst_calls = fake.calls - calls
+            assert len(set(replies)) == 1 and replies[0], "burst did not share one reply"
+
+            calls = fake.calls
+            hit_latency = []
+            start = time.perf_counter()
+            for i in range(questions):
+                q, lang = faqs[i % len(faqs)]
+                q = variants(q)[i % 4]
+                t0 = time.perf_counter()
+                hits = cache.hits
+                assert await cache.get_or_load(cache.key(q, lang), lambda: server._llm_reply(q, lang))
+                if cache.hits > hits:
+                    hit_latency.append(time.perf_counter() - t0)
+            elapsed = time.perf_counter() - start
+        finally:
+            await server.http_session.close()
+            server.http_session = None
+        stats = cache.stats()
+        self.report("Chat reply cache (FAQ workload, local fake completion server)", [
+            {"scenario": "concurrent identical", "requests": len(burst), "upstream_calls": burst_calls},
+            {
+                "scenario": "faq mix",
+                "requests": questions,
+                "upstream_calls": fake.calls - calls,
+                "hit_ratio": stats["hit_ratio"],
+                "hit_p50_us": f"{sorted(hit_latency)[len(hit_latency) // 2] * 1e6:6.1f}",
+                "avg_ms": f"{elapsed / questions * 1000:6.3f}",
+                "bytes": stats["bytes"],
+            },
+        ])
+
+    def bench_pipelined_messages(self, fake, pairs=5):
+        """A retyped question supersedes the pending one instead of queueing behind it"""
+        server.OPENAI_BASE_URL = fake.url
+        server.reply_cache = server.ReplyCache()
+        latencies = []
+        with TestClient(server.app) as client, client.websocket_connect("/ws/chat") as ws:
+            for i in range(pairs):
+                start = time.perf_counter()
+                ws.send_json({"id": f"{i}-a", "text": f"first draft {i}", "stream": False})
+                time.sleep(0.05)
+                ws.send_json({"id": f"{i}-b", "text": f"retyped question {i}", "stream": False})
+                frames = {}
+                while f"{i}-b" not in frames:
+                    frame = ws.receive_json()
+                    frames[frame["id"]] = frame
+                latencies.append(time.perf_counter() - start)
+                assert frames[f"{i}-a"].get("cancelled"), frames
+            stats = client.get("/api/chat/metrics").json()["chat"]
+        one_reply = fake.first_token + fake.token_gap * (fake.tokens - 1)
+        self.report("/ws/chat pipelining (second message sent 50 ms after the first)", [{
+            "pairs": pairs,
+            "retyped_reply_p50_ms": self.pct(latencies, 0.50),
+            "sequential_would_be_ms": f"{(2 * one_reply) * 1000:7.1f}",
+            "superseded": stats["superseded"],
+        }])
+
+    async def bench_llm_limiter(self, fake, sockets=200, max_concurrent=8, max_waiting=32, wait_timeout=0.5):
+        """Burst of concurrent chats against the process-wide LLM limit"""
+        server.OPENAI_BASE_URL = fake.url
+        server.reply_cache = server.ReplyCache()
+        server.llm_limiter = limiter = server.LLMLimiter(max_concurrent, max_waiting, wait_timeout)
+        fake.max_active = 0
+        llm_reply = "".join(fake.words())
+
+        async def noop(frame):
+            pass
+
+        async def chat(i):
+            start = time.perf_counter()
+            reply = await server._chat_reply(noop, f"burst question {i}", "en", stream=False)
+            return reply == llm_reply, time.perf_counter() - start
+
+        try:
+            results = await asyncio.gather(*(chat(i) for i in range(sockets)))
+        finally:
+            await server.http_session.close()
+            server.http_session = None
+        fallbacks = [elapsed for from_llm, elapsed in results if not from_llm]
+        snapshot = limiter.snapshot()
+        self.report(f"LLM concurrency limit ({sockets} simultaneous questions, limit {max_concurrent}, queue {max_waiting})", [{
+            "upstream_max_concurrent": fake.max_active,
+            "llm_replies": len(results) - len(fallbacks),
+            "rejected": snapshot["rejected"],
+            "timed_out": snapshot["timed_out"],
+            "fallback_p50_ms": self.pct(fallbacks, 0.50) if fallbacks else None,
+            "queue_wait_p95_ms": snapshot["queue_wait_p95_ms"],
+        }])
+        assert fake.max_active <= max_concurrent, "LLM limit exceeded"
+
+    def bench_conversation_memory(self, sockets=10_000, turns=200):
+        """Per-connection history memory after long conversations on many sockets"""
+        rows = []
+        question = "How much does it cost to repaint a two bedroom flat with primer?"
+        answer = "ಪೇಂಟಿಂಗ್ ಬೆಲೆ ಗೋಡೆಯ ವಿಸ್ತೀರ್ಣ ಮತ್ತು ಬಣ್ಣದ ಪ್ರಕಾರವನ್ನು ಅವಲಂಬಿಸಿದೆ. " * 4
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        memories = []
+        for i in range(sockets):
+            memory = server.ConversationMemory(server.CHAT_HISTORY_TURNS, server.CHAT_HISTORY_TOKENS, server.CHAT_HISTORY_MAX_CHARS)
+            for t in range(turns):
+                memory.append(t % 2 == 0, f"{question if t % 2 == 0 else answer} #{i}.{t}")
+            memories.append(memory)
+        traced = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        rows.append({
+            "sockets": sockets,
+            "turns_each": turns,
+            "kept_turns": len(memories[0]),
+            "kept_tokens": memories[0].tokens,
+            "bytes/socket": traced // sockets,
+            "nbytes/socket": memories[0].nbytes(),
+            "total_mb": f"{traced / 1e6:6.1f}",
+        })
+        self.report("Conversation memory (ring buffer + token budget)", rows)
+
+    async def bench_transcript_writer(self, turns=10_000, insert_ms=20.0):
+        """Batched transcript persistence vs one insert per row"""
+        calls = []
+
+        async def insert(rows):
+            await asyncio.sleep(insert_ms / 1000)
+            calls.append(len(rows))
+
+        writer = server.TranscriptWriter(insert, interval=0.05)
+        start = time.perf_counter()
+        for i in range(turns):
+            writer.add(server.transcript_rows("booking", "user", f"question {i}", f"reply {i}"))
+            if i % 100 == 0:
+                await asyncio.sleep(0)
+        await writer.aclose()
+        elapsed = time.perf_counter() - start
+        assert sum(calls) == 2 * turns, "rows lost"
+        self.report("Chat transcript persistence", [{
+            "rows": 2 * turns,
+            "inserts": len(calls),
+            "inserts_before": 2 * turns,
+            "max_batch": max(calls),
+            "elapsed_ms": f"{elapsed * 1000:7.1f}",
+        }])
+
+    @contextlib.contextmanager
+    def redis_url(self):
+        """REDIS_URL if set, else a throwaway redis-server when one is installed, else None"""
+        url = os.environ.get("REDIS_URL")
+        if url or aioredis is None or not shutil.which("redis-server"):
+            yield url if aioredis is not None else None
+            return
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        proc = subprocess.Popen(
+            ["redis-server", "--port", str(port), "--save", "", "--appendonly", "no"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            for _ in range(50):
+                with socket.socket() as conn:
+                    if conn.connect_ex(("127.0.0.1", port)) == 0:
+                        break
+                time.sleep(0.1)
+            yield f"redis://127.0.0.1:{port}/0"
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    async def bench_cross_worker_fanout(self, messages=2000):
+        """Publish on worker A, deliver to a socket held by worker B.
+
+        With Redis the two workers use separate RedisBroker connections, and
+        the run also checks subscription refcounting and that delivery resumes
+        after every channel was dropped (the listener restarts).
+        """
+        rows = []
+        with self.redis_url() as url:
+            setups = [("in-process (single process, no broker hop)", lambda: (InProcessBroker(),) * 2)]
+            if url:
+                setups.append(("redis (separate connections)", lambda: (
+                    RedisBroker(aioredis.from_url(url)), RedisBroker(aioredis.from_url(url)))))
+            else:
+                rows.append({"broker": "redis", "skipped": "set REDIS_URL or install redis-server and the redis package"})
+            for name, make in setups:
+                rows.append(await self._fanout_run(name, *make(), messages))
+        self.report("Cross-worker chat delivery latency", rows)
+
+    async def _fanout_run(self, name, broker_a, broker_b, messages):
+        worker_a, worker_b = ConnectionRegistry(broker_a), ConnectionRegistry(broker_b)
+        latencies = []
+        received = asyncio.Event()
+
+        async def send(frame):
+            latencies.append(time.perf_counter() - frame["sent_at"])
+            received.set()
+
+        async def close():
+            pass
+
+        async def roundtrip(i):
+            received.clear()
+            await worker_a.publish("user:bench", {"text": f"message {i}", "sent_at": time.perf_counter()})
+            await asyncio.wait_for(received.wait(), 5)
+
+        settle = 0.1 if isinstance(broker_b, RedisBroker) else 0  # let the Redis subscription settle
+        outbox = await worker_b.register(["user:bench"], send, close)
+        await asyncio.sleep(settle)
+        for i in range(messages):
+            await roundtrip(i)
+
+        # A second socket on the channel shares the subscription; dropping one keeps it
+        extra = await worker_b.register(["user:bench"], send, close)
+        await worker_b.unregister(outbox)
+        await roundtrip(messages)
+        # Dropping the last socket unsubscribes; a new socket must subscribe again
+        await worker_b.unregister(extra)
+        await asyncio.sleep(settle * 2)
+        outbox = await worker_b.register(["user:bench"], send, close)
+        await asyncio.sleep(settle)
+        await roundtrip(messages + 1)
+        await worker_b.unregister(outbox)
+
+        await worker_a.aclose()
+        if broker_b is not broker_a:
+            await worker_b.aclose()
+        return {
+            "broker": name,
+            "messages": messages,
+            "p50_us": f"{sorted(latencies)[len(latencies) // 2] * 1e6:8.1f}",
+            "p99_us": f"{sorted(latencies)[int(len(latencies) * 0.99)] * 1e6:8.1f}",
+            "resubscribed": True,
+        }
+
+    async def bench_slow_consumer(self, messages=5000, outbox_size=64, max_drops=0):
+        """A stalled socket on a busy channel is cut off without slowing the others"""
+        registry = ConnectionRegistry(InProcessBroker(), outbox_size=outbox_size, max_drops=max_drops)
+        fast, closed = [], []
+
+        async def fast_send(frame):
+            fast.append(frame)
+
+        async def slow_send(frame):
+            await asyncio.sleep(1)
+
+        async def slow_close():
+            closed.append(True)
+
+        await registry.register(["booking:bench"], fast_send, slow_close)
+        slow = await registry.register(["booking:bench"], slow_send, slow_close)
+        start = time.perf_counter()
+        for i in range(messages):
+            await registry.publish("booking:bench", {"text": f"update {i}"})
+            if i % 64 == 0:
+                await asyncio.sleep(0)
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(0.01)
+        stats = registry.stats()
+        self.report(f"Slow consumer backpressure (outbox {outbox_size}, {max_drops} drops allowed before disconnect)", [{
+            "published": messages,
+            "fast_delivered": len(fast),
+            "slow_dropped": slow.dropped,
+            "slow_cut_off": bool(closed),
+            "publish_us": f"{elapsed / messages * 1e6:6.1f}",
+            "queued": stats["queued"],
+        }])
+        assert len(fast) == messages and closed, "slow consumer held up delivery"
+        await registry.aclose()
+
+    def run_all(self):
+        print("🚀 Starting chat benchmarks...")
+        print("=" * 60)
+        fake = FakeCompletionServer().start()
+        try:
+            self.bench_time_to_first_token(fake)
+            asyncio.run(self.bench_reply_cache(fake))
+            self.bench_pipelined_messages(fake)
+            asyncio.run(self.bench_llm_limiter(fake))
+            self.bench_conversation_memory()
+            asyncio.run(self.bench_transcript_writer())
+            asyncio.run(self.bench_cross_worker_fanout())
+            asyncio.run(self.bench_slow_consumer())
+        finally:
+            fake.stop()
+        return 0
+
+
+def main():
+    return ChatBenchmark().run_all()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
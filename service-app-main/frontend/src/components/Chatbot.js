@@ -16,6 +16,9 @@ const Chatbot = () => {
   const messagesEndRef = useRef(null);
   const wsRef = useRef(null);
   const reconnectTimer = useRef(null);
+  // Message ids double as request ids: replies and cancellations echo them
+  const nextId = useRef(2);
+  const pending = useRef(new Set());
 
   const backendHttp = process.env.REACT_APP_BACKEND_URL || '';
   const wsUrl = (() => {
@@ -73,14 +76,50 @@ const Chatbot = () => {
       ws.onmessage = (event) => {
         try {
           const data = JSON.parse(event.data);
-          if (typeof data?.text === 'string') {
-            setMessages(prev => [...prev, { id: prev.length + 1, text: data.text, sender: data.sender || 'bot', timestamp: new Date() }]);
+          const replyTo = data?.id;
+          // The bot bubble answering request `replyTo` (frames without an id are pushed to the socket)
+          const findReply = (list) => (replyTo === undefined ? -1 : list.findIndex(m => m.replyTo === replyTo));
+          const settle = () => {
+            if (replyTo !== undefined) pending.current.delete(replyTo);
+            setIsTyping(pending.current.size > 0);
+          };
+          if (data?.cancelled) {
+            // Superseded or cancelled request: drop its partial bubble
+            setMessages(prev => prev.filter(m => replyTo === undefined || m.replyTo !== replyTo));
+            settle();
+          } else if (typeof data?.delta === 'string') {
+            // Streamed tokens grow the request's bubble until the full reply arrives.
+            // Ids are taken outside the updaters: StrictMode runs updaters twice
+            const id = nextId.current++;
+            setMessages(prev => {
+              const index = findReply(prev);
+              if (index >= 0) {
+                const reply = prev[index];
+                return [...prev.slice(0, index), { ...reply, text: reply.text + data.delta }, ...prev.slice(index + 1)];
+              }
+              return [...prev, { id, replyTo, text: data.delta, sender: 'bot', streaming: true, timestamp: new Date() }];
+            });
             setIsTyping(false);
+          } else if (typeof data?.text === 'string') {
+            const id = nextId.current++;
+            setMessages(prev => {
+              const index = findReply(prev);
+              const reply = { id, replyTo, text: data.text, sender: data.sender || 'bot', timestamp: new Date() };
+              if (index >= 0) {
+                return [...prev.slice(0, index), { ...reply, id: prev[index].id }, ...prev.slice(index + 1)];
+              }
+              return [...prev, reply];
+            });
+            settle();
           }
         } catch {}
       };
       ws.onclose = () => {
         setConnected(false);
+        // Replies to requests on this socket will not arrive
+        pending.current.clear();
+        setIsTyping(false);
+        setMessages(prev => prev.map(m => (m.streaming ? { ...m, streaming: false } : m)));
         // attempt reconnect after short delay if still open
         if (isOpen) {
           clearTimeout(reconnectTimer.current);
@@ -105,7 +144,7 @@ const Chatbot = () => {
 
     // Add user message
     const userMessage = {
-      id: messages.length + 1,
+      id: nextId.current++,
       text: inputMessage,
       sender: 'user',
       timestamp: new Date()
@@ -116,10 +155,12 @@ const Chatbot = () => {
     // Send to backend if connected; otherwise keep typing animation briefly
     if (wsRef.current && connected && wsRef.current.readyState === WebSocket.OPEN) {
       setIsTyping(true);
+      pending.current.add(userMessage.id);
       try {
-        wsRef.current.send(JSON.stringify({ text: userMessage.text, lang: language }));
+        wsRef.current.send(JSON.stringify({ id: userMessage.id, text: userMessage.text, lang: language }));
       } catch {
-        setIsTyping(false);
+        pending.current.delete(userMessage.id);
+        setIsTyping(pending.current.size > 0);
       }
     }
   };
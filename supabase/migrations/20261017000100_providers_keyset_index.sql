@@ -0,0 +1,2 @@
+-- Keyset pagination for GET /api/providers orders by (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_providers_created_at_id ON public.providers (created_at, id);
@@ -0,0 +1,23 @@
+-- Counter blocks for the backend provider ID allocator (PROVIDER_ID_SOURCE=database).
+-- Each call reserves block_size consecutive counter values and returns the first one;
+-- the backend maps counters to 123456A-style IDs through a keyed permutation.
+CREATE TABLE IF NOT EXISTS public.provider_id_counter (
+  id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  next_value BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO public.provider_id_counter (id, next_value) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING;
+ALTER TABLE public.provider_id_counter ENABLE ROW LEVEL SECURITY;
+
+CREATE OR REPLACE FUNCTION public.reserve_provider_id_block(block_size INTEGER)
+RETURNS BIGINT
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+  -- The single-row UPDATE takes a row lock, so concurrent callers get disjoint blocks
+  UPDATE public.provider_id_counter
+  SET next_value = next_value + GREATEST(block_size, 1)
+  WHERE id
+  RETURNING next_value - GREATEST(block_size, 1);
+$$;
+
+REVOKE ALL ON FUNCTION public.reserve_provider_id_block(INTEGER) FROM PUBLIC, anon, authenticated;
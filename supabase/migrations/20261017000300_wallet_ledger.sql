@@ -0,0 +1,69 @@
+-- Append-only wallet ledger. Balances are exact NUMERIC values and only change
+-- through apply_wallet_entries(), which records each entry once per
+-- idempotency key and moves the balance in the same transaction.
+ALTER TABLE public.providers
+  ALTER COLUMN wallet_balance TYPE NUMERIC(14, 2) USING round(wallet_balance::numeric, 2),
+  ALTER COLUMN wallet_balance SET DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS public.wallet_ledger (
+  id BIGSERIAL PRIMARY KEY,
+  provider_id TEXT NOT NULL,
+  amount NUMERIC(14, 2) NOT NULL,
+  balance_after NUMERIC(14, 2),
+  idempotency_key TEXT NOT NULL,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  UNIQUE (provider_id, idempotency_key)
+);
+ALTER TABLE public.wallet_ledger ENABLE ROW LEVEL SECURITY;
+
+-- p_entries: [{"amount": "12.50", "idempotency_key": "..."}]
+-- Returns {"balance": "<new balance>", "applied": [keys], "duplicates": [keys]}.
+-- Raises SQLSTATE P0002 when the provider does not exist.
+CREATE OR REPLACE FUNCTION public.apply_wallet_entries(p_provider_id TEXT, p_entries JSONB)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+  entry JSONB;
+  applied TEXT[] := '{}';
+  duplicates TEXT[] := '{}';
+  total NUMERIC(14, 2) := 0;
+  new_balance NUMERIC(14, 2);
+  inserted_id BIGINT;
+BEGIN
+  FOR entry IN SELECT * FROM jsonb_array_elements(p_entries) LOOP
+    -- The unique key serialises retries of the same entry
+    inserted_id := NULL;
+    INSERT INTO public.wallet_ledger (provider_id, amount, idempotency_key)
+    VALUES (p_provider_id, (entry->>'amount')::numeric, entry->>'idempotency_key')
+    ON CONFLICT (provider_id, idempotency_key) DO NOTHING
+    RETURNING id INTO inserted_id;
+    IF inserted_id IS NULL THEN
+      duplicates := duplicates || (entry->>'idempotency_key');
+    ELSE
+      applied := applied || (entry->>'idempotency_key');
+      total := total + (entry->>'amount')::numeric;
+    END IF;
+  END LOOP;
+
+  UPDATE public.providers
+  SET wallet_balance = wallet_balance + total,
+      updated_at = CASE WHEN total <> 0 THEN now() ELSE updated_at END
+  WHERE provider_id = p_provider_id
+  RETURNING wallet_balance INTO new_balance;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'provider % not found', p_provider_id USING ERRCODE = 'P0002';
+  END IF;
+
+  IF array_length(applied, 1) > 0 THEN
+    UPDATE public.wallet_ledger
+    SET balance_after = new_balance
+    WHERE provider_id = p_provider_id AND idempotency_key = ANY (applied);
+  END IF;
+
+  RETURN jsonb_build_object('balance', new_balance::text, 'applied', to_jsonb(applied), 'duplicates', to_jsonb(duplicates));
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.apply_wallet_entries(TEXT, JSONB) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,39 @@
+-- Batched email verification for the provider backend's write-behind queue.
+-- p_entries: [{"key": "...", "email": "..." | "provider_id": "...", "verified_at": "<timestamptz>"}]
+-- Returns one row per matched provider: {key, id, provider_id, changed}.
+-- Providers that are already verified are matched but not written again, so
+-- replayed events (e.g. auth webhook retries) are no-ops.
+CREATE OR REPLACE FUNCTION public.mark_emails_verified(p_entries JSONB)
+RETURNS TABLE (key TEXT, id TEXT, provider_id TEXT, changed BOOLEAN)
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+  WITH entries AS (
+    SELECT e->>'key' AS key,
+           e->>'email' AS email,
+           e->>'provider_id' AS provider_id,
+           (e->>'verified_at')::timestamptz AS verified_at
+    FROM jsonb_array_elements(p_entries) AS e
+  ),
+  matched AS (
+    SELECT entries.key, p.id, p.provider_id, entries.verified_at,
+           NOT (p.email_verified AND p.email_verified_at IS NOT NULL) AS needs_write
+    FROM entries
+    JOIN public.providers p
+      ON (entries.email IS NOT NULL AND p.email = entries.email)
+      OR (entries.email IS NULL AND p.provider_id = entries.provider_id)
+  ),
+  updated AS (
+    UPDATE public.providers p
+    SET email_verified = TRUE,
+        email_verified_at = COALESCE(p.email_verified_at, m.verified_at),
+        updated_at = now()
+    FROM matched m
+    WHERE p.id = m.id AND m.needs_write
+    RETURNING p.id
+  )
+  SELECT m.key, m.id::text, m.provider_id, m.id IN (SELECT updated.id FROM updated)
+  FROM matched m;
+$$;
+
+REVOKE ALL ON FUNCTION public.mark_emails_verified(JSONB) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,67 @@
+-- Registration in one round trip. Uniqueness is enforced by constraints
+-- rather than a select-then-insert, so concurrent registrations of the same
+-- mobile number cannot both succeed. Remove existing duplicates before
+-- applying this migration.
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'providers_mobile_number_key') THEN
+    ALTER TABLE public.providers ADD CONSTRAINT providers_mobile_number_key UNIQUE (mobile_number);
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'providers_provider_id_key') THEN
+    ALTER TABLE public.providers ADD CONSTRAINT providers_provider_id_key UNIQUE (provider_id);
+  END IF;
+END $$;
+
+-- p_provider: a providers row as JSON; p_profile: optional profiles row
+-- (upserted first so the provider's foreign key is satisfied).
+-- Both are decoded with jsonb_populate_record so every value is cast to its
+-- column type. The profile upsert is best-effort, as it always was: if it
+-- fails a warning is raised and registration carries on (a missing profile
+-- then surfaces as the provider's foreign-key error, if there is one).
+-- Only the registration columns are inserted, so any other column keeps its
+-- default; flags, balance and timestamps sent as null fall back as well.
+-- Returns the inserted provider row. A duplicate raises unique_violation
+-- (23505) naming the constraint, which the backend maps to a 400.
+CREATE OR REPLACE FUNCTION public.register_provider(p_provider JSONB, p_profile JSONB DEFAULT NULL)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+  inserted public.providers;
+BEGIN
+  IF p_profile IS NOT NULL THEN
+    BEGIN
+      INSERT INTO public.profiles (id, role, full_name)
+      SELECT p.id, p.role, p.full_name
+      FROM jsonb_populate_record(NULL::public.profiles, p_profile) AS p
+      ON CONFLICT (id) DO UPDATE
+      SET role = EXCLUDED.role,
+          full_name = COALESCE(EXCLUDED.full_name, public.profiles.full_name);
+    EXCEPTION WHEN OTHERS THEN
+      RAISE WARNING 'register_provider: profile upsert for % failed: %', p_profile->>'id', SQLERRM;
+    END;
+  END IF;
+
+  INSERT INTO public.providers (
+    id, provider_id, professions, professional_status, is_verified, email_verified,
+    email, mobile_number, has_trade_license, has_health_permit, has_certificates,
+    verification_date, email_verified_at, wallet_balance, created_at, updated_at,
+    documents, qr_code, id_card_path
+  )
+  SELECT
+    r.id, r.provider_id, r.professions,
+    r.professional_status, COALESCE(r.is_verified, false),
+    COALESCE(r.email_verified, false), r.email, r.mobile_number,
+    COALESCE(r.has_trade_license, false), COALESCE(r.has_health_permit, false),
+    COALESCE(r.has_certificates, false), r.verification_date, r.email_verified_at,
+    COALESCE(r.wallet_balance, 0), COALESCE(r.created_at, now()), COALESCE(r.updated_at, now()),
+    r.documents, r.qr_code, r.id_card_path
+  FROM jsonb_populate_record(NULL::public.providers, p_provider) AS r
+  RETURNING * INTO inserted;
+
+  RETURN to_jsonb(inserted);
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.register_provider(JSONB, JSONB) FROM PUBLIC, anon, authenticated;